@@ -1,16 +1,68 @@
 # 6.00.2x Problem Set 2: Simulating robots
 
+import array
+import collections
+import functools
+import hashlib
+import itertools
 import math
+import multiprocessing
+import os
 import random
+import tempfile
+import time
 
+import numpy
 import ps2_visualize
-import pylab
+import ps_checkpoint
+import ps_kernels
 
-# For Python 2.7:
-from ps2_verify_movement27 import testRobotMovement
 
-# If you get a "Bad magic number" ImportError, you are not using 
-# Python 2.7 and using most likely Python 2.6:
+# pylab and the movement checker are imported on first use, so that importing
+# this module (e.g. in a pool worker or on a node without a display) neither
+# loads the plotting stack nor runs anything.
+def _pylab():
+    """
+    Returns the pylab module, importing it on first use.
+    """
+    import pylab
+    return pylab
+
+
+def testRobotMovement(robot_type, room_type, delay=0.4):
+    """
+    Shows ROBOT_TYPE moving in a room of type ROOM_TYPE, using the provided
+    ps2_verify_movement27 checker.
+    """
+    # For Python 2.7:
+    from ps2_verify_movement27 import testRobotMovement
+
+    # If you get a "Bad magic number" ImportError, you are not using 
+    # Python 2.7 and using most likely Python 2.6:
+    return testRobotMovement(robot_type, room_type, delay)
+
+
+# Directions are whole degrees (see Robot.__init__), so the unit vector
+# (sin, cos) of each one is computed once, with the same math calls as
+# Position.getNewPosition would make. The same numbers as arrays indexed by
+# direction are shared with the vectorized engines (ps2_fleet and
+# ps_kernels.robotSteps).
+_UNIT_VECTORS = dict((d, (math.sin(math.radians(float(d))),
+                          math.cos(math.radians(float(d)))))
+                     for d in range(360))
+SIN_TABLE = numpy.array([_UNIT_VECTORS[d][0] for d in range(360)])
+COS_TABLE = numpy.array([_UNIT_VECTORS[d][1] for d in range(360)])
+
+
+def _unitVector(angle):
+    """
+    Returns (sin, cos) of ANGLE (in degrees), from the table if possible.
+    """
+    unit = _UNIT_VECTORS.get(angle)
+    if unit is None:
+        angle = float(angle)
+        unit = (math.sin(math.radians(angle)), math.cos(math.radians(angle)))
+    return unit
 
 
 # === Provided class Position
@@ -18,6 +70,8 @@ class Position(object):
     """
     A Position represents a location in a two-dimensional room.
     """
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         """
         Initializes a position with coordinates (x, y).
@@ -39,10 +93,10 @@ class Position(object):
         Returns: a Position object representing the new position.
         """
         old_x, old_y = self.x, self.y
-        angle = float(angle)
         # Compute the change in position
-        delta_y = speed * math.cos(math.radians(angle))
-        delta_x = speed * math.sin(math.radians(angle))
+        unit = _unitVector(angle)
+        delta_y = speed * unit[1]
+        delta_x = speed * unit[0]
         # Add that to the existing position
         new_x = old_x + delta_x
         new_y = old_y + delta_y
@@ -61,6 +115,8 @@ class RectangularRoom(object):
     A room has a width and a height and contains (width * height) tiles. At any
     particular time, each of these tiles is either clean or dirty.
     """
+    __slots__ = ('width', 'height', 'cleanTile', 'cleanedLog')
+
     def __init__(self, width, height):
         """
         Initializes a rectangular room with the specified width and height.
@@ -76,6 +132,9 @@ class RectangularRoom(object):
         for w in range(width):
             for h in range(height):
                 self.cleanTile[(w,h)] = False
+        # Flat indices of the cleaned tiles, in the order they were cleaned,
+        # once logCleanedTiles() is called
+        self.cleanedLog = None
     
     def cleanTileAtPosition(self, pos):
         """
@@ -85,7 +144,10 @@ class RectangularRoom(object):
 
         pos: a Position
         """
-        self.cleanTile[(math.floor(pos.x), math.floor(pos.y))] = True
+        tile = (math.floor(pos.x), math.floor(pos.y))
+        if self.cleanedLog is not None and not self.cleanTile[tile]:
+            self.cleanedLog.append(int(tile[0]) * self.height + int(tile[1]))
+        self.cleanTile[tile] = True
 
     def isTileCleaned(self, m, n):
         """
@@ -99,6 +161,19 @@ class RectangularRoom(object):
         """
         return self.cleanTile[(m, n)]
 
+    def cleanTileIndices(self, indices):
+        """
+        Mark the tiles with flat indices INDICES as cleaned, where tile (m, n)
+        has index m * height + n.
+
+        indices: an iterable of ints
+        """
+        for index in indices:
+            tile = (int(index) // self.height, int(index) % self.height)
+            if self.cleanedLog is not None and not self.cleanTile[tile]:
+                self.cleanedLog.append(int(index))
+            self.cleanTile[tile] = True
+
     
     def getNumTiles(self):
         """
@@ -116,13 +191,47 @@ class RectangularRoom(object):
         """
         return sum(self.cleanTile.values())
 
-    def getRandomPosition(self):
+    def _cleanedIndices(self):
+        """
+        Return the flat indices of the cleaned tiles, in index order.
+        """
+        return sorted(int(m) * self.height + int(n)
+                      for (m, n), clean in self.cleanTile.items() if clean)
+
+    def logCleanedTiles(self):
+        """
+        Start logging the tiles cleaned, for getCleanedTilesSince(). The
+        tiles already clean are logged first, in index order. Rooms keep no
+        log unless asked, since it takes a word per cleaned tile; a
+        visualization asks for one so that it only redraws the tiles that
+        changed since its last frame.
+        """
+        if self.cleanedLog is None:
+            self.cleanedLog = array.array('l', self._cleanedIndices())
+
+    def getCleanedTilesSince(self, count):
+        """
+        Return the tiles cleaned after the first COUNT logged tiles, in the
+        order they were cleaned. Needs logCleanedTiles() to have been called.
+
+        count: an integer (0 <= count <= getNumCleanedTiles())
+        returns: a list of (m, n) tuples
+        """
+        if self.cleanedLog is None:
+            raise ValueError("the room keeps no log; call logCleanedTiles()")
+        height = self.height
+        return [(index // height, index % height)
+                for index in self.cleanedLog[count:]]
+
+    def getRandomPosition(self, rng=random):
         """
         Return a random position inside the room.
 
+        rng: where to draw from (the random module, or an object with its
+             random() method, such as a ps_random.CounterStream)
         returns: a Position object.
         """
-        return Position(random.random() * self.width, random.random() * self.height)
+        return Position(rng.random() * self.width, rng.random() * self.height)
 
     def isPositionInRoom(self, pos):
         """
@@ -133,6 +242,568 @@ class RectangularRoom(object):
         """
         return ( ( pos.x >= 0 and pos.x < self.width) and ( pos.y >= 0 and pos.y < self.height) )
 
+    def isCoordinateInRoom(self, x, y):
+        """
+        Return True if the point (x, y) is inside the room. Same test as
+        isPositionInRoom, without needing a Position object.
+
+        x: a float
+        y: a float
+        returns: True if (x, y) is in the room, False otherwise.
+        """
+        return 0 <= x < self.width and 0 <= y < self.height
+
+
+class BitmapRoom(RectangularRoom):
+    """
+    A BitmapRoom is a RectangularRoom that keeps its tiles in a bytearray (one
+    byte per tile, tile (m, n) at index m * height + n) and a running count of
+    cleaned tiles, so getNumCleanedTiles() does not scan the room.
+    """
+    __slots__ = ('tiles', 'numCleaned')
+
+    def __init__(self, width, height):
+        """
+        Initializes a rectangular room with the specified width and height.
+
+        Initially, no tiles in the room have been cleaned.
+
+        width: an integer > 0
+        height: an integer > 0
+        """
+        self.width = width
+        self.height = height
+        self.tiles = bytearray(width * height)
+        self.numCleaned = 0
+        self.cleanedLog = None
+
+    def cleanTileAtPosition(self, pos):
+        """
+        Mark the tile under the position POS as cleaned.
+
+        Assumes that POS represents a valid position inside this room.
+
+        pos: a Position
+        """
+        index = int(pos.x) * self.height + int(pos.y)
+        if not self.tiles[index]:
+            self.tiles[index] = 1
+            self.numCleaned += 1
+            if self.cleanedLog is not None:
+                self.cleanedLog.append(index)
+
+    def isTileCleaned(self, m, n):
+        """
+        Return True if the tile (m, n) has been cleaned.
+
+        Assumes that (m, n) represents a valid tile inside the room.
+
+        m: an integer
+        n: an integer
+        returns: True if (m, n) is cleaned, False otherwise
+        """
+        return self.tiles[m * self.height + n] == 1
+
+    def cleanTileIndices(self, indices):
+        """
+        Mark the tiles with flat indices INDICES as cleaned, where tile (m, n)
+        has index m * height + n.
+
+        indices: an iterable of ints
+        """
+        tiles = numpy.frombuffer(self.tiles, dtype=numpy.uint8)
+        if not isinstance(indices, numpy.ndarray):
+            indices = numpy.fromiter(indices, dtype=numpy.intp)
+        indices = indices.astype(numpy.intp, copy=False)
+        indices = numpy.unique(indices[tiles[indices] == 0])
+        tiles[indices] = 1
+        self.numCleaned += len(indices)
+        if self.cleanedLog is not None:
+            self.cleanedLog.extend(indices.tolist())
+
+    def getNumCleanedTiles(self):
+        """
+        Return the total number of clean tiles in the room.
+
+        returns: an integer
+        """
+        return self.numCleaned
+
+    def _cleanedIndices(self):
+        """
+        Return the flat indices of the cleaned tiles, in index order.
+        """
+        return numpy.flatnonzero(
+            numpy.frombuffer(self.tiles, dtype=numpy.uint8)).tolist()
+
+
+class ChunkedRoom(RectangularRoom):
+    """
+    A ChunkedRoom is a RectangularRoom for very large, sparsely cleaned
+    floors. Building one costs nothing: the room is split into CHUNK x CHUNK
+    blocks of tiles, and a block's bitmap (one bit per tile) is only created
+    when a robot first cleans a tile in it. The bitmaps can be kept in memory
+    or in a memory-mapped file of the room's own, and a running count of
+    cleaned tiles keeps getNumCleanedTiles() O(1).
+    """
+    __slots__ = ('chunk', 'chunkBytes', 'chunkRows', 'chunks', 'numCleaned',
+                 'backing', 'backingPath')
+
+    def __init__(self, width, height, chunk=64, path=None):
+        """
+        Initializes a rectangular room with the specified width and height.
+
+        Initially, no tiles in the room have been cleaned.
+
+        width: an integer > 0
+        height: an integer > 0
+        chunk: side of a block of tiles (an integer > 0)
+        path: a directory (a string) in which the room creates a new file to
+              memory-map its bitmaps to, or None to keep them in memory. Two
+              live rooms must never share a file, so every room (e.g. every
+              trial of runSimulation, in any worker) gets its own; its name
+              is in backingPath, and the file is left behind for the caller
+              to remove.
+        """
+        if chunk <= 0:
+            raise ValueError("chunk must be positive, not %r" % (chunk,))
+        if path is not None and not os.path.isdir(path):
+            raise ValueError("%s is not a directory" % (path,))
+        self.width = width
+        self.height = height
+        self.chunk = chunk
+        # One bit per tile, rounded up to whole bytes
+        self.chunkBytes = (chunk * chunk + 7) // 8
+        self.chunkRows = (height + chunk - 1) // chunk
+        self.chunks = {}
+        self.numCleaned = 0
+        self.cleanedLog = None
+        self.backing = None
+        self.backingPath = None
+        if path is not None:
+            fd, self.backingPath = tempfile.mkstemp(prefix='chunkedroom-',
+                                                    suffix='.bin', dir=path)
+            os.close(fd)
+            # Written as a sparse file, so untouched blocks take no disk
+            num_chunks = ((width + chunk - 1) // chunk) * self.chunkRows
+            self.backing = numpy.memmap(self.backingPath, dtype=numpy.uint8,
+                                        mode='w+',
+                                        shape=(num_chunks * self.chunkBytes,))
+
+    def _newChunk(self, key):
+        """
+        Creates, stores and returns the bitmap of block KEY.
+        """
+        if self.backing is None:
+            bitmap = bytearray(self.chunkBytes)
+        else:
+            offset = (key[0] * self.chunkRows + key[1]) * self.chunkBytes
+            bitmap = self.backing[offset:offset + self.chunkBytes]
+        self.chunks[key] = bitmap
+        return bitmap
+
+    def _cleanTile(self, m, n):
+        """
+        Mark the tile (m, n) as cleaned.
+        """
+        chunk = self.chunk
+        key = (m // chunk, n // chunk)
+        bitmap = self.chunks.get(key)
+        if bitmap is None:
+            bitmap = self._newChunk(key)
+        bit = (m % chunk) * chunk + n % chunk
+        mask = 1 << (bit & 7)
+        if not bitmap[bit >> 3] & mask:
+            bitmap[bit >> 3] |= mask
+            self.numCleaned += 1
+            if self.cleanedLog is not None:
+                self.cleanedLog.append(m * self.height + n)
+
+    def cleanTileAtPosition(self, pos):
+        """
+        Mark the tile under the position POS as cleaned.
+
+        Assumes that POS represents a valid position inside this room.
+
+        pos: a Position
+        """
+        self._cleanTile(int(pos.x), int(pos.y))
+
+    def cleanTileIndices(self, indices):
+        """
+        Mark the tiles with flat indices INDICES as cleaned, where tile (m, n)
+        has index m * height + n.
+
+        indices: an iterable of ints
+        """
+        height = self.height
+        for index in indices:
+            self._cleanTile(int(index) // height, int(index) % height)
+
+    def isTileCleaned(self, m, n):
+        """
+        Return True if the tile (m, n) has been cleaned.
+
+        Assumes that (m, n) represents a valid tile inside the room.
+
+        m: an integer
+        n: an integer
+        returns: True if (m, n) is cleaned, False otherwise
+        """
+        chunk = self.chunk
+        bitmap = self.chunks.get((m // chunk, n // chunk))
+        if bitmap is None:
+            return False
+        bit = (m % chunk) * chunk + n % chunk
+        return bool(bitmap[bit >> 3] & (1 << (bit & 7)))
+
+    def getNumCleanedTiles(self):
+        """
+        Return the total number of clean tiles in the room.
+
+        returns: an integer
+        """
+        return self.numCleaned
+
+    def _cleanedIndices(self):
+        """
+        Return the flat indices of the cleaned tiles, in index order.
+        """
+        chunk = self.chunk
+        indices = []
+        for (i, j), bitmap in self.chunks.items():
+            # Bit b of a block is bit b & 7 of byte b >> 3
+            bits = numpy.unpackbits(numpy.frombuffer(bitmap, numpy.uint8))
+            bits = bits.reshape(-1, 8)[:, ::-1].ravel()
+            cleaned = numpy.flatnonzero(bits)
+            indices.extend(((i * chunk + cleaned // chunk) * self.height +
+                            j * chunk + cleaned % chunk).tolist())
+        return sorted(indices)
+
+    def getNumChunks(self):
+        """
+        Return the number of blocks whose bitmap has been created.
+
+        returns: an integer
+        """
+        return len(self.chunks)
+
+    def flush(self):
+        """
+        Write the bitmaps out to the memory-mapped file, if there is one.
+        """
+        if self.backing is not None:
+            self.backing.flush()
+
+
+class UnreachableCoverageException(Exception):
+    """
+    UnreachableCoverageException is raised by runTrial when the robots
+    cannot reach enough tiles of the room to ever clean the requested
+    fraction of it.
+    """
+
+
+class FloorPlan(object):
+    """
+    A FloorPlan is the layout of a room with obstacles: which tiles are
+    blocked, and which free tiles are connected to each other. It is built
+    once and shared by all the ObstacleRooms of a simulation.
+
+    Free tiles are connected when they touch along an edge or at a corner: a
+    robot with speed <= 1 can move between them, since only the position it
+    lands on is tested.
+    """
+    def __init__(self, width, height, obstacles=(), blocked=None):
+        """
+        Lays out a WIDTH x HEIGHT floor.
+
+        obstacles: a list of (x0, y0, x1, y1) rectangles of blocked tiles,
+                   covering the tiles (m, n) with x0 <= m < x1, y0 <= n < y1
+        blocked: a mask of blocked tiles indexed as blocked[m][n] (nested
+                 lists or a NumPy array of shape (width, height)), or None
+        """
+        self.width = width
+        self.height = height
+        self.blocked = bytearray(width * height)
+        for x0, y0, x1, y1 in obstacles:
+            for m in range(max(x0, 0), min(x1, width)):
+                for n in range(max(y0, 0), min(y1, height)):
+                    self.blocked[m * height + n] = 1
+        if blocked is not None:
+            for m in range(width):
+                for n in range(height):
+                    if blocked[m][n]:
+                        self.blocked[m * height + n] = 1
+        self.numFree = width * height - sum(self.blocked)
+        if self.numFree == 0:
+            raise ValueError("every tile of the floor is blocked")
+        self._labelComponents()
+
+    def getKey(self):
+        """
+        Returns a tuple identifying the layout, for cache and checkpoint
+        keys: the size and a digest of the blocked tiles.
+        """
+        return ('FloorPlan', self.width, self.height,
+                hashlib.sha1(bytes(self.blocked)).hexdigest())
+
+    def _labelComponents(self):
+        """
+        Sets self.labels, the connected component of every free tile (-1 for
+        blocked tiles), and self.componentSizes, the number of tiles in each.
+        """
+        width, height = self.width, self.height
+        # Search a copy of the floor with a blocked border, so that every
+        # tile has all 8 neighbours
+        side = height + 2
+        free = bytearray(side * (width + 2))
+        for m in range(width):
+            row = self.blocked[m * height:(m + 1) * height]
+            free[(m + 1) * side + 1:(m + 2) * side - 1] = \
+                bytearray(1 - b for b in row)
+        steps = (-side - 1, -side, -side + 1, -1, 1, side - 1, side, side + 1)
+        padded = [-1] * len(free)
+        self.componentSizes = []
+        for start in range(len(free)):
+            if not free[start]:
+                continue
+            label = len(self.componentSizes)
+            free[start] = 0
+            padded[start] = label
+            stack = [start]
+            size = 0
+            while stack:
+                index = stack.pop()
+                size += 1
+                for step in steps:
+                    other = index + step
+                    if free[other]:
+                        free[other] = 0
+                        padded[other] = label
+                        stack.append(other)
+            self.componentSizes.append(size)
+        labels = numpy.array(padded, dtype=numpy.int32).reshape(width + 2, side)
+        self.labels = labels[1:-1, 1:-1].ravel()
+
+    def getNumReachableTiles(self, positions):
+        """
+        Return the number of free tiles connected to a tile under one of
+        POSITIONS.
+
+        positions: a list of Position objects on free tiles
+        returns: an integer
+        """
+        components = set(int(self.labels[int(pos.x) * self.height + int(pos.y)])
+                         for pos in positions)
+        return sum(self.componentSizes[label] for label in components)
+
+
+class ObstacleRoom(BitmapRoom):
+    """
+    An ObstacleRoom is a BitmapRoom with furniture: the blocked tiles of its
+    FloorPlan can never be entered or cleaned, and only free tiles count
+    towards the room's tiles.
+    """
+    __slots__ = ('plan',)
+
+    def __init__(self, width, height, plan):
+        """
+        Initializes a room with the specified width, height and layout.
+
+        Initially, no tiles in the room have been cleaned. To pass the room
+        to runSimulation, bind the plan first, e.g.
+        functools.partial(ObstacleRoom, plan=plan).
+
+        width: an integer > 0
+        height: an integer > 0
+        plan: a FloorPlan of the same size
+        """
+        if (plan.width, plan.height) != (width, height):
+            raise ValueError("floor plan is %dx%d, room is %dx%d" %
+                             (plan.width, plan.height, width, height))
+        BitmapRoom.__init__(self, width, height)
+        self.plan = plan
+
+    def getNumTiles(self):
+        """
+        Return the number of free (unblocked) tiles in the room.
+
+        returns: an integer
+        """
+        return self.plan.numFree
+
+    def getRandomPosition(self, rng=random):
+        """
+        Return a random position on a free tile of the room.
+
+        rng: where to draw from (see RectangularRoom.getRandomPosition)
+        returns: a Position object.
+        """
+        while True:
+            pos = Position(rng.random() * self.width,
+                           rng.random() * self.height)
+            if not self.plan.blocked[int(pos.x) * self.height + int(pos.y)]:
+                return pos
+
+    def isPositionInRoom(self, pos):
+        """
+        Return True if pos is inside the room and not on a blocked tile.
+
+        pos: a Position object.
+        returns: True if pos is in the room, False otherwise.
+        """
+        return self.isCoordinateInRoom(pos.x, pos.y)
+
+    def isCoordinateInRoom(self, x, y):
+        """
+        Return True if the point (x, y) is inside the room and not on a
+        blocked tile.
+
+        x: a float
+        y: a float
+        returns: True if (x, y) is in the room, False otherwise.
+        """
+        return (0 <= x < self.width and 0 <= y < self.height and
+                not self.plan.blocked[int(x) * self.height + int(y)])
+
+    def getNumReachableTiles(self, robots):
+        """
+        Return the number of free tiles that ROBOTS can ever reach, or
+        getNumTiles() if a robot is fast enough to jump over obstacles.
+
+        robots: a list of Robot objects in this room
+        returns: an integer
+        """
+        if any(robot.speed > 1.0 for robot in robots):
+            return self.getNumTiles()
+        return self.plan.getNumReachableTiles([robot.position
+                                               for robot in robots])
+
+
+
+class TileStats(object):
+    """
+    TileStats records, for every tile of a WIDTH x HEIGHT room, how often
+    robots landed on it and at which time-step it was first cleaned, and
+    aggregates both over trials.
+
+    Pass it to runSimulation (tile_stats=...) to instrument the trials; rooms
+    without it pay nothing, since only the rooms of instrumented trials are
+    built from instrumentedRoom(room_type).
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.numTrials = 0
+        self.visits = numpy.zeros((width, height), dtype=numpy.int64)
+        self.firstCleanSum = numpy.zeros((width, height))
+        self.firstCleanCount = numpy.zeros((width, height), dtype=numpy.int64)
+        self.step = 0
+        self._visits = None
+        self._firstClean = None
+
+    def beginTrial(self):
+        """
+        Starts recording a new trial, at time-step 0.
+        """
+        self.step = 0
+        self._visits = array.array('l', [0]) * (self.width * self.height)
+        self._firstClean = array.array('l', [-1]) * (self.width * self.height)
+
+    def record(self, m, n):
+        """
+        Records a robot landing on tile (m, n) at the current time-step.
+        """
+        index = m * self.height + n
+        self._visits[index] += 1
+        if self._firstClean[index] < 0:
+            self._firstClean[index] = self.step
+
+    def endTrial(self):
+        """
+        Adds the trial being recorded to the totals.
+        """
+        shape = (self.width, self.height)
+        self.visits += numpy.frombuffer(self._visits, dtype='l').reshape(shape)
+        first = numpy.frombuffer(self._firstClean, dtype='l').reshape(shape)
+        cleaned = first >= 0
+        self.firstCleanSum[cleaned] += first[cleaned]
+        self.firstCleanCount += cleaned
+        self.numTrials += 1
+        self._visits = self._firstClean = None
+
+    def getMeanVisits(self):
+        """
+        Returns the mean number of visits per trial of each tile (a float
+        array of shape (width, height)).
+        """
+        return self.visits / float(max(self.numTrials, 1))
+
+    def getMeanFirstCleanTime(self):
+        """
+        Returns the mean time-step at which each tile was first cleaned, over
+        the trials in which it was cleaned (NaN if it never was).
+        """
+        mean = numpy.empty((self.width, self.height))
+        mean.fill(numpy.nan)
+        cleaned = self.firstCleanCount > 0
+        mean[cleaned] = self.firstCleanSum[cleaned] / self.firstCleanCount[cleaned]
+        return mean
+
+    def save(self, path):
+        """
+        Saves the aggregated arrays to the .npz file PATH.
+        """
+        numpy.savez(path, visits=self.visits, firstCleanSum=self.firstCleanSum,
+                    firstCleanCount=self.firstCleanCount,
+                    numTrials=self.numTrials)
+
+    def saveHeatmaps(self, path, title=''):
+        """
+        Draws the mean-visits and mean-first-clean-time heatmaps side by side
+        and saves the figure to PATH (any format pylab can write).
+        """
+        pylab = _pylab()
+        figure = pylab.figure(figsize=(10, 4))
+        for i, (data, label) in enumerate(
+                [(self.getMeanVisits(), 'Mean visits per trial'),
+                 (self.getMeanFirstCleanTime(), 'Mean first-clean time-step')]):
+            axes = figure.add_subplot(1, 2, i + 1)
+            image = axes.imshow(data.T, origin='lower', interpolation='nearest',
+                                extent=(0, self.width, 0, self.height))
+            axes.set_title(label)
+            figure.colorbar(image, ax=axes)
+        if title:
+            figure.suptitle(title)
+        figure.savefig(path)
+        pylab.close(figure)
+
+
+_instrumentedRooms = {}
+
+
+def instrumentedRoom(room_type):
+    """
+    Returns a subclass of ROOM_TYPE whose cleanTileAtPosition() also reports
+    every cleaned position to the TileStats in its tileStats attribute. The
+    subclasses are made once per room class; a functools.partial of a room
+    class (e.g. an ObstacleRoom bound to its plan) is instrumented too.
+    """
+    if isinstance(room_type, functools.partial):
+        return functools.partial(instrumentedRoom(room_type.func),
+                                 *room_type.args, **(room_type.keywords or {}))
+    if room_type not in _instrumentedRooms:
+        def cleanTileAtPosition(self, pos):
+            room_type.cleanTileAtPosition(self, pos)
+            self.tileStats.record(int(pos.x), int(pos.y))
+        _instrumentedRooms[room_type] = type(
+            'Instrumented' + room_type.__name__, (room_type,),
+            {'__slots__': ('tileStats',),
+             '__doc__': 'A %s that records its cleaning in a TileStats.' %
+                        room_type.__name__,
+             'cleanTileAtPosition': cleanTileAtPosition})
+    return _instrumentedRooms[room_type]
 
 
 class Robot(object):
@@ -145,7 +816,9 @@ class Robot(object):
     Subclasses of Robot should provide movement strategies by implementing
     updatePositionAndClean(), which simulates a single time-step.
     """
-    def __init__(self, room, speed):
+    __slots__ = ('speed', 'direction', 'position', 'room', 'rng')
+
+    def __init__(self, room, speed, rng=random):
         """
         Initializes a Robot with the given speed in the specified room. The
         robot initially has a random direction and a random position in the
@@ -153,10 +826,13 @@ class Robot(object):
 
         room:  a RectangularRoom object.
         speed: a float (speed > 0)
+        rng: where the robot draws its random numbers from (the random
+             module, or its own stream such as a ps_random.CounterStream)
         """
         self.speed = speed
-        self.direction = int(random.random() * 360)
-        self.position = room.getRandomPosition()
+        self.rng = rng
+        self.direction = int(rng.random() * 360)
+        self.position = room.getRandomPosition(rng)
         self.room = room
         room.cleanTileAtPosition(self.position)
 
@@ -169,6 +845,40 @@ class Robot(object):
         """
         raise NotImplementedError # don't change this!
 
+    def tryMoveAndClean(self):
+        """
+        Try to move the robot one time-step in its current direction.
+
+        If the new position is inside the room, the robot's Position is
+        updated in place, the tile under it is cleaned, and True is returned.
+        Otherwise nothing changes and False is returned. Unlike
+        getNewPosition, no Position object is created.
+        """
+        unit = _unitVector(self.direction)
+        pos = self.position
+        x = pos.x + self.speed * unit[0]
+        y = pos.y + self.speed * unit[1]
+        if not self.room.isCoordinateInRoom(x, y):
+            return False
+        pos.x = x
+        pos.y = y
+        self.room.cleanTileAtPosition(pos)
+        return True
+
+
+def fleetSpec(num_robots, speed, robot_type):
+    """
+    Returns a fleet as a list of (robot_type, speed, count) groups.
+
+    num_robots: an int, in which case the fleet is NUM_ROBOTS robots of type
+                ROBOT_TYPE with speed SPEED, or already a fleet spec such as
+                [(StandardRobot, 1.0, 5), (RandomWalkRobot, 0.5, 3)], which is
+                returned as a list (SPEED and ROBOT_TYPE are then ignored)
+    """
+    if isinstance(num_robots, (list, tuple)):
+        return [tuple(group) for group in num_robots]
+    return [(robot_type, speed, num_robots)]
+
 
 # === Problem 2
 class StandardRobot(Robot):
@@ -179,6 +889,8 @@ class StandardRobot(Robot):
     direction; when it would hit a wall, it *instead* chooses a new direction
     randomly.
     """
+    __slots__ = ()
+
     def updatePositionAndClean(self):
         """
         Simulate the raise passage of a single time-step.
@@ -186,29 +898,435 @@ class StandardRobot(Robot):
         Move the robot to a new position and mark the tile it is on as having
         been cleaned.
         """
-        newPosition = self.position.getNewPosition(self.direction, self.speed)
-        if self.room.isPositionInRoom(newPosition):
-            self.position = newPosition
-            self.room.cleanTileAtPosition(newPosition)
-        else:
-            self.direction = int(random.random() * 360)
+        if not self.tryMoveAndClean():
+            self.direction = int(self.rng.random() * 360)
       
 
 # Uncomment this line to see your implementation of StandardRobot in action!
 #testRobotMovement(StandardRobot, RectangularRoom)
 
 
+# === Event-driven stepping for StandardRobot
+def coverageTarget(min_coverage, num_tiles):
+    """
+    Returns the smallest number of clean tiles c for which
+    float(c) / NUM_TILES >= MIN_COVERAGE, i.e. the tile count at which the
+    loop in runTrial stops.
+
+    min_coverage: a float (0 <= min_coverage <= 1.0)
+    num_tiles: an int (num_tiles > 0)
+    """
+    target = int(math.ceil(min_coverage * num_tiles))
+    while target > 0 and float(target - 1) / num_tiles >= min_coverage:
+        target -= 1
+    while float(target) / num_tiles < min_coverage:
+        target += 1
+    return target
+
+
+def straightRun(x, y, direction, speed, width, height):
+    """
+    Returns the positions a StandardRobot at (X, Y) visits before its next
+    wall hit, as two float arrays (xs, ys). The robot moves len(xs) times and
+    then picks a new direction on the following time-step.
+
+    The positions are accumulated with the same floating-point additions as
+    repeated calls to Position.getNewPosition, so they are bit-identical.
+    """
+    angle = float(direction)
+    delta_x = speed * math.sin(math.radians(angle))
+    delta_y = speed * math.cos(math.radians(angle))
+    # Closed-form guess at the number of moves, checked against the exact
+    # accumulated positions below
+    limit = float('inf')
+    if delta_x > 0:
+        limit = min(limit, (width - x) / delta_x)
+    elif delta_x < 0:
+        limit = min(limit, x / -delta_x)
+    if delta_y > 0:
+        limit = min(limit, (height - y) / delta_y)
+    elif delta_y < 0:
+        limit = min(limit, y / -delta_y)
+    moves = int(limit) + 2
+    while True:
+        xs = numpy.empty(moves + 1)
+        xs.fill(delta_x)
+        xs[0] = x
+        ys = numpy.empty(moves + 1)
+        ys.fill(delta_y)
+        ys[0] = y
+        xs = numpy.add.accumulate(xs)[1:]
+        ys = numpy.add.accumulate(ys)[1:]
+        outside = numpy.flatnonzero((xs < 0) | (xs >= width) |
+                                    (ys < 0) | (ys >= height))
+        if outside.size:
+            return xs[:outside[0]], ys[:outside[0]]
+        moves *= 2
+
+
+def runEventDriven(room, robots, min_coverage):
+    """
+    Runs StandardRobots ROBOTS in ROOM until the fraction MIN_COVERAGE of
+    the room is clean, and returns the number of time-steps taken.
+
+    Instead of one updatePositionAndClean() call per robot per time-step,
+    the clock jumps from one wall hit to the next: each robot's straight run
+    is computed with straightRun(), the tiles it lands on are marked in
+    bulk, and only the wall hits draw new directions. Random numbers are
+    drawn in the same order as the time-stepped loop, so the step count
+    (and the state of the random module afterwards) is exactly the same.
+
+    room: a RectangularRoom (or a subclass without extra walls), but not a
+          ChunkedRoom: the clean tiles are tracked in a dense array
+    robots: a list of StandardRobot objects in ROOM
+    min_coverage: a float (0 <= min_coverage <= 1.0)
+    """
+    if isinstance(room, ObstacleRoom):
+        raise ValueError("event-driven stepping needs a room without obstacles")
+    if isinstance(room, ChunkedRoom):
+        raise ValueError("event-driven stepping would make a ChunkedRoom "
+                         "dense; use BitmapRoom or time-step the trial")
+    width, height = room.width, room.height
+    target = coverageTarget(min_coverage, room.getNumTiles())
+    num_cleaned = room.getNumCleanedTiles()
+    if num_cleaned >= target:
+        return 0
+    cleaned = numpy.zeros(width * height, dtype=bool)
+    for robot in robots:
+        cleaned[int(robot.position.x) * height + int(robot.position.y)] = True
+    # Robot r lands on runs[r][i] at time-step starts[r] + i and picks a new
+    # direction at time-step hits[r]
+    runs, starts, hits = [], [], []
+    for robot in robots:
+        xs, ys = straightRun(robot.position.x, robot.position.y,
+                             robot.direction, robot.speed, width, height)
+        runs.append((xs, ys, xs.astype(numpy.intp) * height +
+                     ys.astype(numpy.intp)))
+        starts.append(1)
+        hits.append(1 + len(xs))
+    now = 0
+    while True:
+        end = min(hits)
+        Ticks, Tiles = [], []
+        for r in range(len(robots)):
+            first = now + 1 - starts[r]
+            last = min(end, hits[r] - 1) - starts[r] + 1
+            if last > first:
+                Tiles.append(runs[r][2][first:last])
+                Ticks.append(numpy.arange(now + 1, now + 1 + last - first))
+        stop = None
+        if Tiles:
+            tiles = numpy.concatenate(Tiles)
+            ticks = numpy.concatenate(Ticks)
+            fresh = ~cleaned[tiles]
+            tiles, ticks = tiles[fresh], ticks[fresh]
+            # Keep the earliest time-step at which each tile is cleaned
+            order = numpy.lexsort((ticks, tiles))
+            tiles, ticks = tiles[order], ticks[order]
+            earliest = numpy.ones(len(tiles), dtype=bool)
+            earliest[1:] = tiles[1:] != tiles[:-1]
+            tiles, ticks = tiles[earliest], ticks[earliest]
+            totals = num_cleaned + numpy.cumsum(
+                numpy.bincount(ticks - now - 1, minlength=end - now))
+            reached = numpy.flatnonzero(totals >= target)
+            if reached.size:
+                stop = now + 1 + int(reached[0])
+                done = ticks <= stop
+                tiles = tiles[done]
+            cleaned[tiles] = True
+            num_cleaned += len(tiles)
+            room.cleanTileIndices(tiles)
+        if stop is None:
+            stop = end
+        # Leave every robot where the time-stepped loop would have left it
+        for r, robot in enumerate(robots):
+            moved = min(stop, hits[r] - 1) - starts[r] + 1
+            if moved > 0:
+                robot.position = Position(float(runs[r][0][moved - 1]),
+                                          float(runs[r][1][moved - 1]))
+        if stop == end:
+            for r, robot in enumerate(robots):
+                if hits[r] == end:
+                    robot.direction = int(robot.rng.random() * 360)
+        if num_cleaned >= target:
+            return stop
+        for r, robot in enumerate(robots):
+            if hits[r] == end:
+                xs, ys = straightRun(robot.position.x, robot.position.y,
+                                     robot.direction, robot.speed,
+                                     width, height)
+                runs[r] = (xs, ys, xs.astype(numpy.intp) * height +
+                           ys.astype(numpy.intp))
+                starts[r] = end + 1
+                hits[r] = end + 1 + len(xs)
+        now = end
+
+
 # === Problem 3
+def trialSeed(seed, trial):
+    """
+    Returns the random seed used for trial number TRIAL of a simulation
+    seeded with SEED, so that every trial draws from its own sequence no
+    matter which process runs it.
+
+    seed: a non-negative int
+    trial: a non-negative int (trial < 2**32)
+    """
+    return (seed << 32) + trial
+
+
+def _setUpTrial(num_robots, speed, width, height, min_coverage, robot_type,
+                room_type, seed, tile_stats=None, streams=None):
+    """
+    Seeds the random module (unless SEED is None), builds the room and
+    places the robots for one trial, and returns (room, robots). If
+    TILE_STATS is not None, the room is instrumented and a new trial is
+    started in it. If STREAMS is not None, robot r (numbered over the whole
+    fleet) draws from its own stream STREAMS(SEED, r); SEED must then be
+    given.
+
+    Raises an UnreachableCoverageException if the room can tell that the
+    robots will never reach MIN_COVERAGE.
+    """
+    if seed is not None:
+        random.seed(seed)
+    if tile_stats is None:
+        room = room_type(width, height)
+    else:
+        room = instrumentedRoom(room_type)(width, height)
+        room.tileStats = tile_stats
+        tile_stats.beginTrial()
+    Fleet = [(group_type, group_speed)
+             for group_type, group_speed, count
+             in fleetSpec(num_robots, speed, robot_type)
+             for r in range(count)]
+    if streams is None:
+        Robots = [group_type(room, group_speed)
+                  for group_type, group_speed in Fleet]
+    else:
+        Robots = [group_type(room, group_speed, streams(seed, r))
+                  for r, (group_type, group_speed) in enumerate(Fleet)]
+    if hasattr(room, 'getNumReachableTiles'):
+        reachable = room.getNumReachableTiles(Robots)
+        if float(reachable) / room.getNumTiles() < min_coverage:
+            raise UnreachableCoverageException(
+                "the robots can reach only %d of %d tiles" %
+                (reachable, room.getNumTiles()))
+    return room, Robots
+
+
+def _runKernelTrial(room, robots, min_coverage):
+    """
+    Runs a trial with ps_kernels.robotSteps and returns its number of
+    time-steps, leaving ROOM, ROBOTS and the random module as the per-tick
+    loop of runTrial would. Returns None (without running anything) unless
+    ROOM is a RectangularRoom or BitmapRoom and every robot a StandardRobot
+    or RandomWalkRobot drawing from the random module.
+    """
+    if type(room) not in (RectangularRoom, BitmapRoom):
+        return None
+    if not all(type(robot) in (StandardRobot, RandomWalkRobot) and
+               robot.rng is random for robot in robots):
+        return None
+    num_tiles = room.getNumTiles()
+    if type(room) is BitmapRoom:
+        # The kernel writes straight into the room's bytearray
+        tiles = numpy.frombuffer(room.tiles, dtype=numpy.uint8)
+    else:
+        tiles = numpy.zeros(num_tiles, dtype=numpy.uint8)
+        for (m, n), clean in room.cleanTile.items():
+            if clean:
+                tiles[int(m) * room.height + int(n)] = 1
+    start_cleaned = num_cleaned = int(tiles.sum())
+    x = numpy.array([robot.position.x for robot in robots])
+    y = numpy.array([robot.position.y for robot in robots])
+    direction = numpy.array([robot.direction for robot in robots],
+                            dtype=numpy.intp)
+    speed = numpy.array([robot.speed for robot in robots], dtype=float)
+    walker = numpy.array([type(robot) is RandomWalkRobot for robot in robots])
+    cleaned_log = numpy.zeros(num_tiles, dtype=numpy.intp)
+    blocks = ps_kernels.UniformBlocks()
+    step = robot = 0
+    done = False
+    while not done:
+        step, robot, num_cleaned, used, done = ps_kernels.robotSteps(
+            x, y, direction, speed, walker, tiles, room.width, room.height,
+            num_cleaned, float(num_tiles), min_coverage, cleaned_log, step,
+            robot, blocks.next(), SIN_TABLE, COS_TABLE)
+    blocks.settle(used)
+    cleaned = cleaned_log[start_cleaned:num_cleaned]
+    if type(room) is BitmapRoom:
+        room.numCleaned = num_cleaned
+    else:
+        for index in cleaned.tolist():
+            room.cleanTile[(index // room.height, index % room.height)] = True
+    if room.cleanedLog is not None:
+        room.cleanedLog.extend(cleaned.tolist())
+    for i, robot in enumerate(robots):
+        robot.position.x = float(x[i])
+        robot.position.y = float(y[i])
+        robot.direction = int(direction[i])
+    return step
+
+
+def runTrial(num_robots, speed, width, height, min_coverage, robot_type,
+             room_type=RectangularRoom, seed=None, event_driven=False,
+             anim=None, tile_stats=None, streams=None):
+    """
+    Runs a single trial of the simulation and returns the number of
+    time-steps needed to clean the fraction MIN_COVERAGE of the room.
+
+    The room is built here, so a trial only holds its own room in memory.
+    If SEED is not None, the random module is seeded with it first. If
+    EVENT_DRIVEN is True, the trial is run with runEventDriven; otherwise,
+    with no ANIM or TILE_STATS, it is run by the compiled robot kernel when
+    numba is installed (see ps_kernels), with the same result. Raises an
+    UnreachableCoverageException if the room can tell that the robots will
+    never reach MIN_COVERAGE (see ObstacleRoom).
+
+    anim: an object with update(room, robots) and done() methods that is
+          shown the start of every time-step and then the state the trial
+          finished in (so a trial of n time-steps gives n + 1 updates), e.g.
+          a ps2_visualize.RobotVisualization or, without a display, a
+          ps2_render.FrameRenderer (or None)
+    tile_stats: a TileStats to record the trial's visits and first-clean
+                times into, or None
+    streams: a factory of per-robot random streams (see runSimulation), or
+             None; without a SEED, one is drawn from the random module
+
+    See runSimulation for the other arguments.
+    """
+    if event_driven and (anim is not None or tile_stats is not None):
+        raise ValueError("event-driven trials have no time-steps to record")
+    if streams is not None and seed is None:
+        seed = random.getrandbits(32)
+    room, Robots = _setUpTrial(num_robots, speed, width, height,
+                               min_coverage, robot_type, room_type, seed,
+                               tile_stats, streams)
+    step = 0
+    if event_driven:
+        return runEventDriven(room, Robots, min_coverage)
+    
+    # To visualize robot movement, pass e.g.
+    #anim = ps2_visualize.RobotVisualization(num_robots, width, height)
+    
+    #anim = ps2_visualize.RobotVisualization(num_robots, width, height, delay=0.1) 
+    ## delay specifies how many seconds the program should pause between frames (default = 0.2, i.e. 5 fps). 
+    ## increase delay value to make the animation slower; decrease -> faster (0.01 is reasonable) 
+    
+    if anim is None and tile_stats is None and ps_kernels.useKernels():
+        steps = _runKernelTrial(room, Robots, min_coverage)
+        if steps is not None:
+            return steps
+
+    while (float(room.getNumCleanedTiles()) / room.getNumTiles()) < min_coverage:
+        if anim is not None:
+            anim.update(room, Robots)
+        if tile_stats is not None:
+            tile_stats.step = step + 1
+        
+        for robot in Robots:
+            robot.updatePositionAndClean()
+        step += 1
+    if anim is not None:
+        anim.update(room, Robots)
+        anim.done()
+    if tile_stats is not None:
+        tile_stats.endTrial()
+    return step
+
+
+def _runTrialArgs(args):
+    """
+    Unpacks ARGS for runTrial; used as the function mapped over a process
+    pool, which can only pass a single argument.
+    """
+    return runTrial(*args)
+
+
+def _typeName(cls):
+    """
+    Returns the name of the class (or functools.partial of one) CLS.
+    """
+    if isinstance(cls, functools.partial):
+        return _typeName(cls.func)
+    return cls.__name__
+
+
+def _argumentKey(value):
+    "Returns VALUE for roomTypeKey: its key if it has one, else its repr."
+    if hasattr(value, 'getKey'):
+        return value.getKey()
+    return repr(value)
+
+
+def roomTypeKey(room_type):
+    """
+    Returns a tuple identifying ROOM_TYPE (a room class, or a
+    functools.partial of one such as an ObstacleRoom bound to its plan) for
+    cache and checkpoint keys: the class name and the bound arguments, with
+    a FloorPlan identified by its contents.
+    """
+    if isinstance(room_type, functools.partial):
+        keywords = room_type.keywords or {}
+        return (roomTypeKey(room_type.func) +
+                tuple(_argumentKey(arg) for arg in room_type.args) +
+                tuple((name, _argumentKey(keywords[name]))
+                      for name in sorted(keywords)))
+    return (room_type.__name__,)
+
+
+def _simulationKey(num_robots, speed, width, height, min_coverage,
+                   num_trials, robot_type, room_type, seed, event_driven,
+                   streams):
+    """
+    Returns a string identifying a runSimulation run, for its checkpoint.
+    """
+    fleet = [(_typeName(group_type), float(group_speed), count)
+             for group_type, group_speed, count
+             in fleetSpec(num_robots, speed, robot_type)]
+    return repr(('runSimulation', fleet, width, height, float(min_coverage),
+                 num_trials, roomTypeKey(room_type), seed, event_driven,
+                 None if streams is None else _typeName(streams)))
+
+
+def _collectSteps(Steps, results, saver, seed):
+    """
+    Appends the trial step counts RESULTS to STEPS as they arrive, saving
+    the progress to the ps_checkpoint.Checkpoint SAVER (if not None).
+    """
+    for steps in results:
+        Steps.append(steps)
+        if saver is not None:
+            saver.save({'seed': seed, 'steps': Steps})
+
+
 def runSimulation(num_robots, speed, width, height, min_coverage, num_trials,
-                  robot_type):
+                  robot_type, room_type=RectangularRoom, workers=None,
+                  pool=None, seed=None, event_driven=False,
+                  tile_stats=None, checkpoint=None, checkpoint_interval=60.0,
+                  streams=None):
     """
     Runs NUM_TRIALS trials of the simulation and returns the mean number of
     time-steps needed to clean the fraction MIN_COVERAGE of the room.
 
     The simulation is run with NUM_ROBOTS robots of type ROBOT_TYPE, each with
-    speed SPEED, in a room of dimensions WIDTH x HEIGHT.
+    speed SPEED, in a room of dimensions WIDTH x HEIGHT. For a mixed fleet,
+    pass a fleet spec such as [(StandardRobot, 1.0, 5), (RandomWalkRobot, 0.5,
+    3)] as NUM_ROBOTS (SPEED and ROBOT_TYPE are then ignored).
 
-    num_robots: an int (num_robots > 0)
+    If SEED is given, trial t is seeded with trialSeed(SEED, t), and the
+    result is the same whether the trials run here or in a process pool of
+    any size. Running in a pool without a SEED draws one from the random
+    module.
+
+    With STREAMS, e.g. ps_random.CounterStream, robot r of trial t instead
+    draws all its random numbers from its own stream
+    STREAMS(trialSeed(SEED, t), r), so what a robot does depends only on
+    SEED, t and r; ps2_fleet.runSimulation with the same STREAMS and SEED
+    gives the same result.
+
+    num_robots: an int (num_robots > 0), or a fleet spec (see fleetSpec)
     speed: a float (speed > 0)
     width: an int (width > 0)
     height: an int (height > 0)
@@ -216,32 +1334,302 @@ def runSimulation(num_robots, speed, width, height, min_coverage, num_trials,
     num_trials: an int (num_trials > 0)
     robot_type: class of robot to be instantiated (e.g. StandardRobot or
                 RandomWalkRobot)
+    room_type: class of room to be instantiated (e.g. RectangularRoom,
+               BitmapRoom or ChunkedRoom), called as room_type(width, height)
+    workers: number of worker processes to spread the trials over (an int),
+             or None to run them in this process
+    pool: a multiprocessing.Pool to run the trials in instead of creating
+          one (for reuse across a sweep); overrides WORKERS
+    seed: a non-negative int, or None
+    event_driven: if True, advance StandardRobots from one wall hit to the
+                  next (see runEventDriven) instead of one time-step at a
+                  time; the step counts are the same
+    tile_stats: a TileStats to aggregate per-tile visits and first-clean
+                times of all trials into, or None; trials then run in this
+                process
+    checkpoint: path of a file to save the completed trials and the random
+                state to (see ps_checkpoint), or None. If the file exists,
+                the run resumes from it; it is removed when the run is done.
+                Resuming gives the result of an uninterrupted run.
+    checkpoint_interval: minimum number of seconds between two saves of
+                         the checkpoint (a float)
+    streams: a factory of per-robot random streams, called as
+             streams(seed, robot), or None to draw from the random module;
+             without a SEED, one is drawn from the random module
     """
-    
+    if tile_stats is not None and (workers is not None or pool is not None):
+        raise ValueError("tile statistics are only recorded in this process")
+    if tile_stats is not None and checkpoint is not None:
+        raise ValueError("tile statistics cannot be checkpointed")
+    if event_driven and not all(
+            issubclass(group_type, StandardRobot) for group_type, group_speed,
+            count in fleetSpec(num_robots, speed, robot_type)):
+        raise ValueError("event-driven stepping needs StandardRobots")
     Steps = []
-    Rooms = [RectangularRoom(width, height) for t in range(num_trials)]
+    saver = None
+    if checkpoint is not None:
+        saver = ps_checkpoint.Checkpoint(
+            checkpoint, _simulationKey(num_robots, speed, width, height,
+                                       min_coverage, num_trials, robot_type,
+                                       room_type, seed, event_driven,
+                                       streams),
+            checkpoint_interval)
+        progress = saver.load()
+        if progress is not None:
+            seed, Steps = progress['seed'], progress['steps']
+    if (workers is not None or pool is not None or
+            streams is not None) and seed is None:
+        seed = random.getrandbits(32)
+    if seed is None:
+        Seeds = [None] * num_trials
+    else:
+        Seeds = [trialSeed(seed, t) for t in range(num_trials)]
+    Jobs = [(num_robots, speed, width, height, min_coverage, robot_type,
+             room_type, Seeds[t], event_driven, None, tile_stats, streams)
+            for t in range(len(Steps), num_trials)]
+
+    if pool is None and workers is None:
+        _collectSteps(Steps, itertools.imap(_runTrialArgs, Jobs), saver, seed)
+    elif pool is not None:
+        _collectSteps(Steps, pool.imap(_runTrialArgs, Jobs), saver, seed)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            _collectSteps(Steps, pool.imap(_runTrialArgs, Jobs,
+                                           max(1, num_trials // (4 * workers))),
+                          saver, seed)
+        finally:
+            pool.close()
+            pool.join()
+    if saver is not None:
+        saver.finish()
+    return math.fsum(Steps)/len(Steps)
+
+
+class RunningStats(object):
+    """
+    Running mean and variance of a stream of numbers (Welford's method).
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        """
+        Adds VALUE to the stream.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def getVariance(self):
+        """
+        Returns the sample variance (0.0 for fewer than two values).
+        """
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    def getHalfWidth(self, z):
+        """
+        Returns the half-width of the normal confidence interval for the mean
+        with critical value Z (e.g. 1.96 for 95%).
+        """
+        if self.count == 0:
+            return float('inf')
+        return z * math.sqrt(self.getVariance() / self.count)
+
+
+def studentCritical(z, df):
+    """
+    Returns the critical value of Student's t distribution with DF degrees
+    of freedom for the same two-sided confidence level as the critical value
+    Z of the normal distribution (e.g. 2.262 for z=1.96 and df=9).
+
+    Exact for 1 and 2 degrees of freedom; otherwise the Cornish-Fisher
+    expansion in 1/df, which at 95% is within 0.2% from 3 degrees of
+    freedom on and closer as DF grows.
+
+    z: a float (z > 0)
+    df: an int (df > 0)
+    """
+    if df == 1:
+        return math.tan(math.pi / 2 * math.erf(z / math.sqrt(2)))
+    if df == 2:
+        p = 0.5 * (1 + math.erf(z / math.sqrt(2)))
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z2 = z * z
+    return z * (1 + (z2 + 1) / (4.0 * df) +
+                (5 * z2 ** 2 + 16 * z2 + 3) / (96.0 * df ** 2) +
+                (3 * z2 ** 3 + 19 * z2 ** 2 + 17 * z2 - 15) /
+                (384.0 * df ** 3) +
+                (79 * z2 ** 4 + 776 * z2 ** 3 + 1482 * z2 ** 2 - 1920 * z2 -
+                 945) / (92160.0 * df ** 4))
+
+
+SimulationEstimate = collections.namedtuple(
+    'SimulationEstimate', ['mean', 'ci', 'trials', 'seconds'])
+
+
+def runSimulationAdaptive(num_robots, speed, width, height, min_coverage,
+                          robot_type, rel_half_width=0.05, min_trials=10,
+                          max_trials=1000, z=1.96, room_type=RectangularRoom,
+                          workers=None, seed=None, event_driven=False,
+                          streams=None):
+    """
+    Runs trials of the simulation until the confidence interval for the mean
+    number of time-steps is tight enough, and returns a SimulationEstimate.
+
+    Trials stop once at least MIN_TRIALS have run and the half-width of the
+    interval is at most REL_HALF_WIDTH times the mean, or once MAX_TRIALS
+    have run. With WORKERS, trials run in batches of WORKERS, and the result
+    is cut back to the first trial at which the rule was met, so a given SEED
+    gives the same estimate for any worker count.
+
+    rel_half_width: a float (rel_half_width > 0)
+    min_trials: an int (min_trials > 1)
+    max_trials: an int (max_trials >= min_trials)
+    z: critical value of the normal distribution for the confidence level (a
+       float, 1.96 for 95%); the interval uses the matching critical value
+       of Student's t for the number of trials run (see studentCritical)
+
+    See runSimulation for the other arguments.
+
+    returns: a SimulationEstimate (mean, ci, trials, seconds), where ci is the
+    (low, high) interval and seconds the wall time taken
+    """
+    if min_trials < 2:
+        raise ValueError("min_trials must be at least 2, not %r"
+                         % (min_trials,))
+    if max_trials < min_trials:
+        raise ValueError("max_trials (%r) is less than min_trials (%r)"
+                         % (max_trials, min_trials))
+    start = time.time()
+    if (workers is not None or streams is not None) and seed is None:
+        seed = random.getrandbits(32)
+    pool = None
+    if workers is not None:
+        pool = multiprocessing.Pool(workers)
+    stats = RunningStats()
+    try:
+        while stats.count < max_trials:
+            size = min(workers or 1, max_trials - stats.count)
+            Jobs = []
+            for t in range(stats.count, stats.count + size):
+                Jobs.append((num_robots, speed, width, height, min_coverage,
+                             robot_type, room_type,
+                             None if seed is None else trialSeed(seed, t),
+                             event_driven, None, None, streams))
+            if pool is None:
+                Steps = [_runTrialArgs(job) for job in Jobs]
+            else:
+                Steps = pool.map(_runTrialArgs, Jobs)
+            for steps in Steps:
+                stats.add(steps)
+                if (stats.count >= min_trials and
+                        stats.getHalfWidth(studentCritical(
+                            z, stats.count - 1)) <=
+                        rel_half_width * abs(stats.mean)):
+                    break
+            else:
+                continue
+            break
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    half_width = stats.getHalfWidth(studentCritical(z, stats.count - 1))
+    return SimulationEstimate(stats.mean,
+                              (stats.mean - half_width, stats.mean + half_width),
+                              stats.count, time.time() - start)
+
+
+def iterCoverage(num_robots, speed, width, height, min_coverage, num_trials,
+                 robot_type, stride=1, max_steps=None,
+                 room_type=RectangularRoom, seed=None, streams=None):
+    """
+    Runs NUM_TRIALS trials like runSimulation and yields coverage samples
+    (trial, step, cleaned_tiles) as they go: one at step 0, one every STRIDE
+    time-steps, and one at the step where a trial ends.
+
+    A trial ends when the fraction MIN_COVERAGE of the room is clean, or
+    after MAX_STEPS time-steps if that is not None. Pass the highest
+    coverage of interest (e.g. 1.0) to get whole curves from one batch of
+    runs; with the same SEED, each trial ends at the same step as in
+    runSimulation.
+
+    stride: time-steps between samples (an int > 0)
+    max_steps: an int, or None
+
+    See runSimulation for the other arguments.
+    """
+    if streams is not None and seed is None:
+        seed = random.getrandbits(32)
     for t in range(num_trials):
+        room, Robots = _setUpTrial(
+            num_robots, speed, width, height, min_coverage, robot_type,
+            room_type, None if seed is None else trialSeed(seed, t),
+            streams=streams)
+        num_tiles = room.getNumTiles()
         step = 0
-        Robots = [robot_type(Rooms[t], speed) for r in range(num_robots)]
-        
-        # Uncomment this line to visualize robot movement
-        #anim = ps2_visualize.RobotVisualization(num_robots, width, height)
-        
-        #anim = ps2_visualize.RobotVisualization(num_robots, width, height, delay=0.1) 
-        ## delay specifies how many seconds the program should pause between frames (default = 0.2, i.e. 5 fps). 
-        ## increase delay value to make the animation slower; decrease -> faster (0.01 is reasonable) 
-        
-        while (float(Rooms[t].getNumCleanedTiles()) / Rooms[t].getNumTiles()) < min_coverage:
-            # Uncomment this line to visualize robot movement
-            #anim.update(Rooms[t], Robots)
-            
+        while True:
+            cleaned = room.getNumCleanedTiles()
+            done = (float(cleaned) / num_tiles >= min_coverage or
+                    step == max_steps)
+            if done or step % stride == 0:
+                yield t, step, cleaned
+            if done:
+                break
             for robot in Robots:
                 robot.updatePositionAndClean()
             step += 1
-        Steps.append(step)
-        # Uncomment this line to visualize robot movement
-        #anim.done()
-    return math.fsum(Steps)/len(Steps)
+
+
+def coverageCurves(num_robots, speed, width, height, min_coverage,
+                   num_trials, robot_type, max_steps, stride=1,
+                   room_type=RectangularRoom, seed=None, streams=None):
+    """
+    Runs NUM_TRIALS trials with iterCoverage and returns their coverage
+    curves as a preallocated NumPy array of shape
+    (num_trials, max_steps // stride + 1): entry [t, k] is the number of
+    clean tiles of trial t after k * STRIDE time-steps. Once a trial has
+    ended, its last count is carried forward.
+
+    See iterCoverage for the arguments.
+    """
+    curves = numpy.zeros((num_trials, max_steps // stride + 1),
+                         dtype=numpy.int64)
+    for t, step, cleaned in iterCoverage(num_robots, speed, width, height,
+                                         min_coverage, num_trials, robot_type,
+                                         stride, max_steps, room_type, seed,
+                                         streams):
+        k = -(-step // stride)
+        curves[t, k:] = cleaned
+    return curves
+
+
+def timeToCoverage(curves, num_tiles, thresholds, stride=1):
+    """
+    Returns, for each trial of CURVES (as made by coverageCurves) and each
+    coverage in THRESHOLDS, the first sampled time-step at which the
+    fraction of clean tiles reached it, or -1 if it never did. With
+    STRIDE 1 these are exact step counts, so e.g.
+    numpy.percentile(result[:, i], 90) is a time-to-X% quantile.
+
+    num_tiles: the number of tiles of the room (an int)
+    thresholds: a list of floats (0 <= threshold <= 1.0)
+    returns: an int array of shape (num_trials, len(thresholds))
+    """
+    coverage = curves / float(num_tiles)
+    times = numpy.empty((curves.shape[0], len(thresholds)), dtype=numpy.int64)
+    for i, threshold in enumerate(thresholds):
+        reached = coverage >= threshold
+        first = reached.argmax(axis=1)
+        times[:, i] = numpy.where(reached.any(axis=1), first * stride, -1)
+    return times
+
 
 # === Problem 4
 class RandomWalkRobot(Robot):
@@ -249,6 +1637,8 @@ class RandomWalkRobot(Robot):
     A RandomWalkRobot is a robot with the "random walk" movement strategy: it
     chooses a new direction at random at the end of each time-step.
     """
+    __slots__ = ()
+
     def updatePositionAndClean(self):
         """
         Simulate the passage of a single time-step.
@@ -256,40 +1646,114 @@ class RandomWalkRobot(Robot):
         Move the robot to a new position and mark the tile it is on as having
         been cleaned.
         """
-        newPosition = self.position.getNewPosition(self.direction, self.speed)
-        if self.room.isPositionInRoom(newPosition):
-            self.position = newPosition
-            self.room.cleanTileAtPosition(newPosition)
-        self.direction = int(random.random() * 360)
+        self.tryMoveAndClean()
+        self.direction = int(self.rng.random() * 360)
 
 
 # Uncomment this line to see how much your simulation takes on average
-print  runSimulation(1, 1.0, 5, 5, 1.0, 100, StandardRobot)
+#print  runSimulation(1, 1.0, 5, 5, 1.0, 100, StandardRobot)
 
-def showPlot1(title, x_label, y_label):
+def _sweepPool(workers):
+    """
+    Returns a process pool of WORKERS processes shared by all the
+    runSimulation calls of a plot, or None if WORKERS is None.
+    """
+    if workers is None:
+        return None
+    return multiprocessing.Pool(workers)
+
+
+def _closePool(pool):
+    """
+    Shuts down a pool returned by _sweepPool.
+    """
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def _sweepRun(cache, *args, **kwargs):
+    """
+    Calls runSimulation with ARGS and KWARGS, going through CACHE (a
+    ps2_sweep.SweepCache) if it is not None.
+    """
+    if cache is None:
+        return runSimulation(*args, **kwargs)
+    return cache.runSimulation(*args, **kwargs)
+
+
+def fleetMix(mix, num_robots):
+    """
+    Splits NUM_ROBOTS robots between the groups of MIX and returns the
+    resulting fleet spec (see fleetSpec). Counts are rounded so that they add
+    up to NUM_ROBOTS; groups left with no robots are dropped.
+
+    mix: a list of (robot_type, speed, share) groups, share a float > 0
+    num_robots: an int (num_robots > 0)
+    """
+    total = float(sum(share for robot_type, speed, share in mix))
+    quotas = [num_robots * share / total for robot_type, speed, share in mix]
+    counts = [int(quota) for quota in quotas]
+    # Largest remainders get the robots lost to rounding down
+    by_remainder = sorted(range(len(mix)), key=lambda i: counts[i] - quotas[i])
+    for i in by_remainder[:num_robots - sum(counts)]:
+        counts[i] += 1
+    return [(robot_type, speed, count)
+            for (robot_type, speed, share), count in zip(mix, counts) if count]
+
+
+def showPlot1(title, x_label, y_label, workers=None, cache=None, seed=None,
+              mixes=None):
     """
     What information does the plot produced by this function tell you?
+
+    workers: number of worker processes to run the trials in (an int), or
+             None to run them in this process
+    cache: a ps2_sweep.SweepCache to look results up in (and store them to),
+           or None to always run the simulations
+    seed: random seed passed to runSimulation (a non-negative int, or None)
+    mixes: a list of (label, mix) pairs, one line each, where mix is a list
+           of (robot_type, speed, share) groups (see fleetMix); defaults to
+           all StandardRobots and all RandomWalkRobots at speed 1.0
     """
+    if mixes is None:
+        mixes = [('StandardRobot', [(StandardRobot, 1.0, 1)]),
+                 ('RandomWalkRobot', [(RandomWalkRobot, 1.0, 1)])]
+    pool = _sweepPool(workers)
     num_robot_range = range(1, 11)
-    times1 = []
-    times2 = []
+    times = [[] for mix in mixes]
     for num_robots in num_robot_range:
         print "Plotting", num_robots, "robots..."
-        times1.append(runSimulation(num_robots, 1.0, 20, 20, 0.8, 20, StandardRobot))
-        times2.append(runSimulation(num_robots, 1.0, 20, 20, 0.8, 20, RandomWalkRobot))
-    pylab.plot(num_robot_range, times1)
-    pylab.plot(num_robot_range, times2)
+        for (label, mix), mix_times in zip(mixes, times):
+            fleet = fleetMix(mix, num_robots)
+            if len(fleet) == 1:
+                # A single group runs (and is cached) as a plain simulation
+                robot_type, speed, count = fleet[0]
+                mix_times.append(_sweepRun(cache, count, speed, 20, 20, 0.8, 20, robot_type, pool=pool, seed=seed))
+            else:
+                mix_times.append(_sweepRun(cache, fleet, None, 20, 20, 0.8, 20, None, pool=pool, seed=seed))
+    _closePool(pool)
+    pylab = _pylab()
+    for mix_times in times:
+        pylab.plot(num_robot_range, mix_times)
     pylab.title(title)
-    pylab.legend(('StandardRobot', 'RandomWalkRobot'))
+    pylab.legend([label for label, mix in mixes])
     pylab.xlabel(x_label)
     pylab.ylabel(y_label)
     pylab.show()
 
     
-def showPlot2(title, x_label, y_label):
+def showPlot2(title, x_label, y_label, workers=None, cache=None, seed=None):
     """
     What information does the plot produced by this function tell you?
+
+    workers: number of worker processes to run the trials in (an int), or
+             None to run them in this process
+    cache: a ps2_sweep.SweepCache to look results up in (and store them to),
+           or None to always run the simulations
+    seed: random seed passed to runSimulation (a non-negative int, or None)
     """
+    pool = _sweepPool(workers)
     aspect_ratios = []
     times1 = []
     times2 = []
@@ -297,8 +1761,10 @@ def showPlot2(title, x_label, y_label):
         height = 300/width
         print "Plotting cleaning time for a room of width:", width, "by height:", height
         aspect_ratios.append(float(width) / height)
-        times1.append(runSimulation(2, 1.0, width, height, 0.8, 200, StandardRobot))
-        times2.append(runSimulation(2, 1.0, width, height, 0.8, 200, RandomWalkRobot))
+        times1.append(_sweepRun(cache, 2, 1.0, width, height, 0.8, 200, StandardRobot, pool=pool, seed=seed))
+        times2.append(_sweepRun(cache, 2, 1.0, width, height, 0.8, 200, RandomWalkRobot, pool=pool, seed=seed))
+    _closePool(pool)
+    pylab = _pylab()
     pylab.plot(aspect_ratios, times1)
     pylab.plot(aspect_ratios, times2)
     pylab.title(title)
@@ -324,3 +1790,59 @@ def showPlot2(title, x_label, y_label):
 ##       (... your call here ...)
 ##
 #showPlot2("Time It Takes Two Robots To Clean 80% Of Variously Shaped Rooms", "Aspect ratio", "Time-steps")
+
+
+def main(argv=None):
+    """
+    Command-line entry point: python -m ps2 COMMAND [options]
+
+    Commands:
+      simulate   print the mean time-steps of runSimulation
+      plot1      show the plot of showPlot1
+      plot2      show the plot of showPlot2
+      movement   show StandardRobot in the movement checker
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m ps2',
+                                     description='Simulating robots.')
+    commands = parser.add_subparsers(dest='command')
+    simulate = commands.add_parser('simulate', help='run runSimulation')
+    simulate.add_argument('--robots', type=int, default=1)
+    simulate.add_argument('--speed', type=float, default=1.0)
+    simulate.add_argument('--width', type=int, default=5)
+    simulate.add_argument('--height', type=int, default=5)
+    simulate.add_argument('--coverage', type=float, default=1.0)
+    simulate.add_argument('--trials', type=int, default=100)
+    simulate.add_argument('--robot', default='StandardRobot',
+                          choices=['StandardRobot', 'RandomWalkRobot'])
+    simulate.add_argument('--workers', type=int, default=None)
+    simulate.add_argument('--seed', type=int, default=None)
+    simulate.add_argument('--event-driven', action='store_true')
+    for name in ('plot1', 'plot2'):
+        plot = commands.add_parser(name, help='show ' + name)
+        plot.add_argument('--workers', type=int, default=None)
+        plot.add_argument('--seed', type=int, default=None)
+    commands.add_parser('movement', help='show StandardRobot moving')
+    args = parser.parse_args(argv)
+
+    if args.command == 'simulate':
+        robot_type = {'StandardRobot': StandardRobot,
+                      'RandomWalkRobot': RandomWalkRobot}[args.robot]
+        print runSimulation(args.robots, args.speed, args.width, args.height,
+                            args.coverage, args.trials, robot_type,
+                            room_type=BitmapRoom, workers=args.workers,
+                            seed=args.seed, event_driven=args.event_driven)
+    elif args.command == 'plot1':
+        showPlot1(" Time It Takes 1 - 10 Robots To Clean 80% Of A Room ",
+                  "Number of Robots", "Time-steps",
+                  workers=args.workers, seed=args.seed)
+    elif args.command == 'plot2':
+        showPlot2("Time It Takes Two Robots To Clean 80% Of Variously Shaped Rooms",
+                  "Aspect ratio", "Time-steps",
+                  workers=args.workers, seed=args.seed)
+    else:
+        testRobotMovement(StandardRobot, RectangularRoom)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+# Problem Set 2:
+# Benchmarks for the robot simulator.
+#
+# Times runSimulation, getNumCleanedTiles, Position.getNewPosition and
+# RobotVisualization.update over a grid of fleet sizes, room sizes, coverages
+# and robot types. Every case runs in its own process, so that its peak RSS
+# can be measured and a runaway case can be stopped. Results can be saved as
+# a JSON baseline; a later run compared against it fails if any case got
+# slower than the allowed threshold, or timed out or crashed where it used
+# to run. Baselines are only comparable on the same machine.
+#
+# Usage: python ps2_bench.py [--grid quick|full] [--save FILE]
+#                            [--baseline FILE] [--threshold 0.25]
+
+import json
+import multiprocessing
+import Queue
+import random
+import resource
+import sys
+import time
+
+import ps2
+
+
+ROBOT_TYPES = {'StandardRobot': ps2.StandardRobot,
+               'RandomWalkRobot': ps2.RandomWalkRobot}
+ROOM_TYPES = {'RectangularRoom': ps2.RectangularRoom,
+              'BitmapRoom': ps2.BitmapRoom,
+              'ChunkedRoom': ps2.ChunkedRoom}
+
+# Parameter grids: fleet sizes, room sides, coverages and runSimulation trials
+GRIDS = {
+    'quick': {'robots': (1, 10), 'sizes': (5, 20),
+              'coverages': (0.5, 1.0), 'trials': 3},
+    'full': {'robots': (1, 10, 100), 'sizes': (5, 50, 200, 1000),
+             'coverages': (0.5, 0.8, 1.0), 'trials': 3},
+}
+
+# Rooms larger than this are not drawn by the RobotVisualization cases
+MAX_VISUAL_SIZE = 50
+
+
+def _peakRSS():
+    """
+    Returns the peak resident set size of this process in KiB.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes on macOS
+        rss //= 1024
+    return rss
+
+
+def _timeBatch(func, calls):
+    "Returns the seconds taken by CALLS calls of FUNC."
+    start = time.time()
+    for i in xrange(calls):
+        func()
+    return time.time() - start
+
+
+def _timeCalls(func, min_seconds=0.1, repeat=3):
+    """
+    Finds a batch size for which CALLS calls of FUNC take at least
+    MIN_SECONDS, times REPEAT such batches, and returns (calls, seconds of
+    the fastest batch). As with timeit, the fastest batch is the one least
+    disturbed by the rest of the machine.
+    """
+    calls = 1
+    seconds = _timeBatch(func, calls)
+    while seconds < min_seconds:
+        calls *= 2
+        seconds = _timeBatch(func, calls)
+    for i in range(repeat - 1):
+        seconds = min(seconds, _timeBatch(func, calls))
+    return calls, seconds
+
+
+def benchRunSimulation(num_robots, size, min_coverage, robot_name, trials):
+    """
+    Times runSimulation with NUM_ROBOTS robots of type ROBOT_NAME in a
+    SIZE x SIZE BitmapRoom, and returns (time-steps, robot-steps, seconds).
+    """
+    means = []
+
+    def simulate():
+        # Seeded, so that every call (and every run) does the same work
+        means.append(ps2.runSimulation(num_robots, 1.0, size, size,
+                                       min_coverage, trials,
+                                       ROBOT_TYPES[robot_name],
+                                       room_type=ps2.BitmapRoom, seed=0))
+    calls, seconds = _timeCalls(simulate)
+    steps = int(round(means[0] * trials)) * calls
+    return steps, steps * num_robots, seconds
+
+
+def benchGetNumCleanedTiles(room_name, size):
+    """
+    Times getNumCleanedTiles on a SIZE x SIZE room of type ROOM_NAME with half
+    of its tiles cleaned, and returns (calls, calls, seconds).
+    """
+    room = ROOM_TYPES[room_name](size, size)
+    rng = random.Random(0)
+    for i in xrange(size * size // 2):
+        room.cleanTileAtPosition(ps2.Position(rng.random() * size,
+                                              rng.random() * size))
+    calls, seconds = _timeCalls(room.getNumCleanedTiles)
+    return calls, calls, seconds
+
+
+def benchGetNewPosition():
+    """
+    Times Position.getNewPosition over a spread of directions, and returns
+    (calls, calls, seconds).
+    """
+    position = ps2.Position(2.5, 2.5)
+    directions = [random.Random(0).randrange(360) for i in range(360)]
+
+    def moves():
+        for direction in directions:
+            position.getNewPosition(direction, 1.0)
+    batches, seconds = _timeCalls(moves)
+    calls = batches * len(directions)
+    return calls, calls, seconds
+
+
+def benchVisualizationUpdate(num_robots, size):
+    """
+    Times RobotVisualization.update (with no delay) while NUM_ROBOTS
+    StandardRobots clean a SIZE x SIZE BitmapRoom, and returns (updates,
+    robot updates, seconds). Returns None if there is no display.
+    """
+    try:
+        import ps2_visualize
+        anim = ps2_visualize.RobotVisualization(num_robots, size, size, 0)
+    except Exception:
+        return None
+    random.seed(0)
+    room = ps2.BitmapRoom(size, size)
+    robots = [ps2.StandardRobot(room, 1.0) for i in range(num_robots)]
+
+    def frame():
+        for robot in robots:
+            robot.updatePositionAndClean()
+        anim.update(room, robots)
+    # Stepping the robots is much cheaper than drawing them; it is included
+    # so that every frame has tiles and robots to redraw
+    updates, seconds = _timeCalls(frame)
+    anim.master.destroy()
+    return updates, updates * num_robots, seconds
+
+
+BENCHMARKS = {'runSimulation': benchRunSimulation,
+              'getNumCleanedTiles': benchGetNumCleanedTiles,
+              'getNewPosition': benchGetNewPosition,
+              'RobotVisualization.update': benchVisualizationUpdate}
+
+
+def cases(grid, only=None):
+    """
+    Returns the benchmark cases of GRID as a list of (name, benchmark, args).
+
+    grid: a dict like the values of GRIDS
+    only: names of the benchmarks to include (a list of strings), or None
+          for all of them
+    """
+    result = []
+    if only is None or 'runSimulation' in only:
+        for robot_name in sorted(ROBOT_TYPES):
+            for num_robots in grid['robots']:
+                for size in grid['sizes']:
+                    for min_coverage in grid['coverages']:
+                        result.append((
+                            'runSimulation/%s/robots=%d/size=%d/coverage=%g'
+                            % (robot_name, num_robots, size, min_coverage),
+                            'runSimulation',
+                            (num_robots, size, min_coverage, robot_name,
+                             grid['trials'])))
+    if only is None or 'getNumCleanedTiles' in only:
+        for room_name in sorted(ROOM_TYPES):
+            for size in grid['sizes']:
+                result.append(('getNumCleanedTiles/%s/size=%d'
+                               % (room_name, size),
+                               'getNumCleanedTiles', (room_name, size)))
+    if only is None or 'getNewPosition' in only:
+        result.append(('getNewPosition', 'getNewPosition', ()))
+    if only is None or 'RobotVisualization.update' in only:
+        for num_robots in grid['robots']:
+            for size in grid['sizes']:
+                if size <= MAX_VISUAL_SIZE:
+                    result.append((
+                        'RobotVisualization.update/robots=%d/size=%d'
+                        % (num_robots, size),
+                        'RobotVisualization.update', (num_robots, size)))
+    return result
+
+
+def _runCase(benchmark, args, queue):
+    "Runs one case in a child process and puts its result on QUEUE."
+    timing = BENCHMARKS[benchmark](*args)
+    queue.put((timing, _peakRSS()))
+
+
+def runCase(benchmark, args, timeout=None):
+    """
+    Runs BENCHMARK with ARGS in a fresh process and returns its result as a
+    dict.
+
+    The key status tells how the case ended: 'ok', 'no-display' (a
+    visualization case with no display to draw on), 'timeout' (it took
+    longer than TIMEOUT seconds) or 'error' (the process died without a
+    result; exitcode then holds its exit code). Only an 'ok' result has the
+    keys seconds, steps, steps_per_sec, ns_per_robot_step and peak_rss_kb.
+    For runSimulation a step is a time-step of the whole fleet; for the
+    other benchmarks it is one call.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_runCase,
+                                      args=(benchmark, args, queue))
+    process.start()
+    deadline = None if timeout is None else time.time() + timeout
+    status = 'timeout'
+    # Poll, so that a crashed case does not wait out the whole timeout
+    while deadline is None or time.time() < deadline:
+        try:
+            timing, peak_rss = queue.get(timeout=0.5)
+            status = 'ok' if timing is not None else 'no-display'
+            break
+        except Queue.Empty:
+            if not process.is_alive() and queue.empty():
+                status = 'error'
+                break
+    if process.is_alive():
+        process.terminate()
+    process.join()
+    if status == 'error':
+        return {'status': status, 'exitcode': process.exitcode}
+    if status != 'ok':
+        return {'status': status}
+    steps, robot_steps, seconds = timing
+    return {'status': status,
+            'seconds': seconds,
+            'steps': steps,
+            'steps_per_sec': steps / seconds if seconds else float('inf'),
+            'ns_per_robot_step': 1e9 * seconds / max(robot_steps, 1),
+            'peak_rss_kb': peak_rss}
+
+
+def runBenchmarks(grid, only=None, timeout=None, out=sys.stdout):
+    """
+    Runs the cases of GRID and returns a dict from case name to result (see
+    runCase), including the cases that did not end with status 'ok'. A line
+    per case is written to OUT.
+    """
+    results = {}
+    for name, benchmark, args in cases(grid, only):
+        result = runCase(benchmark, args, timeout)
+        results[name] = result
+        if result['status'] == 'error':
+            out.write('%-60s error (exit code %s)\n'
+                      % (name, result['exitcode']))
+        elif result['status'] != 'ok':
+            out.write('%-60s %s\n' % (name, result['status']))
+        else:
+            out.write('%-60s %14.1f steps/s %12.1f ns/robot-step %9d KiB\n'
+                      % (name, result['steps_per_sec'],
+                         result['ns_per_robot_step'],
+                         result['peak_rss_kb']))
+        out.flush()
+    return results
+
+
+def saveBaseline(path, results):
+    """
+    Writes RESULTS (as returned by runBenchmarks) to PATH as JSON.
+    """
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+
+def loadBaseline(path):
+    """
+    Returns the results saved in PATH by saveBaseline.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def regressions(results, baseline, threshold):
+    """
+    Returns the cases that are slower than in BASELINE by more than the
+    fraction THRESHOLD, as a list of (name, baseline ns, current ns) tuples
+    comparing ns per robot-step. Cases missing from either side or that did
+    not end with status 'ok' on both sides are ignored (see failures).
+
+    threshold: a float (e.g. 0.25 for 25% slower)
+    """
+    slower = []
+    for name in sorted(results):
+        if (name not in baseline or
+                _status(baseline[name]) != 'ok' or
+                _status(results[name]) != 'ok'):
+            continue
+        old = baseline[name]['ns_per_robot_step']
+        new = results[name]['ns_per_robot_step']
+        if new > old * (1 + threshold):
+            slower.append((name, old, new))
+    return slower
+
+
+def _status(result):
+    "Returns the status of RESULT; baselines saved before statuses are ok."
+    return result.get('status', 'ok')
+
+
+def failures(results, baseline):
+    """
+    Returns the cases that ran in BASELINE but now time out or crash, as a
+    list of (name, status) tuples. Visualization cases with no display are
+    not failures.
+    """
+    failed = []
+    for name in sorted(results):
+        status = _status(results[name])
+        if (name in baseline and _status(baseline[name]) == 'ok' and
+                status in ('timeout', 'error')):
+            failed.append((name, status))
+    return failed
+
+
+def main(argv=None):
+    """
+    Command-line entry point. Returns the exit status: 1 if a case regressed,
+    timed out or crashed against the baseline, 0 otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='python ps2_bench.py',
+                                     description='Benchmarking robots.')
+    parser.add_argument('--grid', default='quick', choices=sorted(GRIDS))
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                        help='run only this benchmark (may be repeated)')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='seconds before a case is stopped')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(GRIDS[args.grid], args.only, args.timeout)
+    if args.save:
+        saveBaseline(args.save, results)
+    if args.baseline:
+        baseline = loadBaseline(args.baseline)
+        slower = regressions(results, baseline, args.threshold)
+        for name, old, new in slower:
+            print "REGRESSION %s: %.1f -> %.1f ns/robot-step (%+.0f%%)" % \
+                (name, old, new, 100 * (new / old - 1))
+        failed = failures(results, baseline)
+        for name, status in failed:
+            print "FAILURE %s: %s" % (name, status)
+        if slower or failed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
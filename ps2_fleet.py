@@ -0,0 +1,206 @@
+# Problem Set 2:
+# Vectorized fleet engine for simulated robots.
+#
+# Keeps the positions, directions and speeds of every robot in NumPy arrays
+# and advances the whole fleet in one step, instead of calling
+# updatePositionAndClean() once per robot per time-step.
+
+import math
+import random
+
+import numpy
+
+from ps2 import (COS_TABLE, SIN_TABLE, RandomWalkRobot, StandardRobot,
+                 fleetSpec, trialSeed)
+
+
+def _walksRandomly(robot_type):
+    """
+    Return True if robots of type ROBOT_TYPE pick a new direction on every
+    time-step, False if they only do so when they would hit a wall.
+    """
+    if issubclass(robot_type, RandomWalkRobot):
+        return True
+    if issubclass(robot_type, StandardRobot):
+        return False
+    raise ValueError("no fleet kernel for robot type %s" % robot_type.__name__)
+
+
+class FleetRoom(object):
+    """
+    A FleetRoom is a rectangular room whose tiles are kept in a flat boolean
+    array, so that a whole fleet can clean its tiles in one call.
+
+    Tile (m, n) is stored at index m * height + n.
+    """
+    def __init__(self, width, height):
+        """
+        Initializes a room with the specified width and height, with no tiles
+        cleaned.
+
+        width: an integer > 0
+        height: an integer > 0
+        """
+        self.width = width
+        self.height = height
+        self.tiles = numpy.zeros(width * height, dtype=bool)
+        self.numCleaned = 0
+
+    def cleanTiles(self, xs, ys):
+        """
+        Mark the tiles under the positions (XS[i], YS[i]) as cleaned.
+
+        Assumes that every position lies inside the room.
+
+        xs, ys: float arrays of the same length
+        """
+        index = xs.astype(numpy.intp) * self.height + ys.astype(numpy.intp)
+        index = index[~self.tiles[index]]
+        if index.size:
+            index = numpy.unique(index)
+            self.tiles[index] = True
+            self.numCleaned += index.size
+
+    def isTileCleaned(self, m, n):
+        """
+        Return True if the tile (m, n) has been cleaned.
+        """
+        return bool(self.tiles[m * self.height + n])
+
+    def getNumTiles(self):
+        """
+        Return the total number of tiles in the room.
+        """
+        return self.width * self.height
+
+    def getNumCleanedTiles(self):
+        """
+        Return the total number of clean tiles in the room.
+        """
+        return self.numCleaned
+
+
+class RobotFleet(object):
+    """
+    A RobotFleet is a group of robots cleaning the same FleetRoom.
+
+    Robot i has position (x[i], y[i]), direction direction[i] (whole degrees)
+    and speed speed[i]. Robots with walker[i] set behave like RandomWalkRobot,
+    the others like StandardRobot, so a fleet may mix both types and several
+    speeds.
+    """
+    def __init__(self, room, num_robots, speed, robot_type, rng=numpy.random,
+                 streams=None):
+        """
+        Places NUM_ROBOTS robots of type ROBOT_TYPE with speed SPEED at random
+        positions and directions in ROOM, and cleans the tiles they start on.
+
+        If STREAMS is given, robot i draws its direction, position and turns
+        from STREAMS[i], in the same order as a ps2 robot does, instead of
+        from RNG; a fleet then moves exactly like ps2 robots given the same
+        streams.
+
+        room: a FleetRoom
+        num_robots: an int (num_robots > 0), or a fleet spec of
+                    (robot_type, speed, count) groups (see ps2.fleetSpec)
+        speed: a float (speed > 0)
+        robot_type: StandardRobot or RandomWalkRobot (or a subclass)
+        rng: a numpy.random.RandomState (defaults to the global NumPy state)
+        streams: a list of per-robot random streams (e.g.
+                 ps_random.CounterStream), or None
+        """
+        groups = fleetSpec(num_robots, speed, robot_type)
+        num_robots = sum(count for group_type, group_speed, count in groups)
+        self.room = room
+        self.rng = rng
+        self.streams = streams
+        if streams is None:
+            self.direction = \
+                (rng.random_sample(num_robots) * 360).astype(numpy.intp)
+            self.x = rng.random_sample(num_robots) * room.width
+            self.y = rng.random_sample(num_robots) * room.height
+        else:
+            draws = numpy.array([stream.randoms(3) for stream in streams])
+            self.direction = (draws[:, 0] * 360).astype(numpy.intp)
+            self.x = draws[:, 1] * room.width
+            self.y = draws[:, 2] * room.height
+        self.speed = numpy.concatenate([
+            numpy.repeat(float(group_speed), count)
+            for group_type, group_speed, count in groups])
+        self.walker = numpy.concatenate([
+            numpy.repeat(_walksRandomly(group_type), count)
+            for group_type, group_speed, count in groups])
+        room.cleanTiles(self.x, self.y)
+
+    def step(self):
+        """
+        Simulate the passage of a single time-step for every robot.
+
+        Robots whose move stays inside the room move and clean their new tile;
+        the others stay put and pick a new direction. Random-walk robots pick
+        a new direction whether or not they moved.
+        """
+        room = self.room
+        new_x = self.x + self.speed * SIN_TABLE[self.direction]
+        new_y = self.y + self.speed * COS_TABLE[self.direction]
+        inside = (new_x >= 0) & (new_x < room.width) & \
+                 (new_y >= 0) & (new_y < room.height)
+        if inside.any():
+            new_x = new_x[inside]
+            new_y = new_y[inside]
+            self.x[inside] = new_x
+            self.y[inside] = new_y
+            room.cleanTiles(new_x, new_y)
+        turning = self.walker | ~inside
+        if self.streams is not None:
+            for i in numpy.flatnonzero(turning).tolist():
+                self.direction[i] = int(self.streams[i].random() * 360)
+            return
+        num_turning = numpy.count_nonzero(turning)
+        if num_turning:
+            self.direction[turning] = \
+                (self.rng.random_sample(num_turning) * 360).astype(numpy.intp)
+
+
+def runSimulation(num_robots, speed, width, height, min_coverage, num_trials,
+                  robot_type, rng=numpy.random, streams=None, seed=None):
+    """
+    Vectorized counterpart of ps2.runSimulation: runs NUM_TRIALS trials and
+    returns the mean number of time-steps needed to clean the fraction
+    MIN_COVERAGE of the room.
+
+    num_robots: an int (num_robots > 0), or a fleet spec (see ps2.fleetSpec)
+    speed: a float (speed > 0)
+    width: an int (width > 0)
+    height: an int (height > 0)
+    min_coverage: a float (0 <= min_coverage <= 1.0)
+    num_trials: an int (num_trials > 0)
+    robot_type: StandardRobot or RandomWalkRobot (or a subclass)
+    rng: a numpy.random.RandomState (defaults to the global NumPy state)
+    streams: a factory of per-robot random streams (see ps2.runSimulation),
+             or None to draw from RNG. Robot r of trial t then draws from
+             streams(ps2.trialSeed(SEED, t), r), and the result is the same
+             as that of ps2.runSimulation with the same STREAMS and SEED.
+    seed: a non-negative int, or None to draw one from the random module
+          (only used with STREAMS)
+    """
+    if streams is not None and seed is None:
+        seed = random.getrandbits(32)
+    Steps = []
+    for t in range(num_trials):
+        room = FleetRoom(width, height)
+        fleet_streams = None
+        if streams is not None:
+            fleet_streams = [
+                streams(trialSeed(seed, t), r)
+                for r in range(sum(count for group_type, group_speed, count
+                                   in fleetSpec(num_robots, speed,
+                                                robot_type)))]
+        fleet = RobotFleet(room, num_robots, speed, robot_type, rng,
+                           fleet_streams)
+        step = 0
+        while (float(room.getNumCleanedTiles()) / room.getNumTiles()) < min_coverage:
+            fleet.step()
+            step += 1
+        Steps.append(step)
+    return math.fsum(Steps)/len(Steps)
@@ -0,0 +1,220 @@
+# Problem Set 2:
+# Headless frame renderer for simulated robots.
+#
+# FrameRenderer has the same update(room, robots)/done() interface as
+# ps2_visualize.RobotVisualization, but draws into a NumPy image instead of a
+# Tk window, so robot runs can be turned into videos without a display.
+
+import math
+import os
+import struct
+import zlib
+
+import numpy
+
+from ps2_visualize import CleanedTileTracker
+
+
+DIRTY = (160, 160, 160)
+CLEAN = (255, 255, 255)
+BODY = (0, 0, 0)
+ARROW = (220, 0, 0)
+
+
+def _chunk(tag, data):
+    "Returns a PNG chunk with the given 4-byte TAG and DATA."
+    return struct.pack('>I', len(data)) + tag + data + \
+        struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def _compress(image, level):
+    "Returns the zlib-compressed scanlines of an RGB IMAGE (filter type 0)."
+    rows = numpy.zeros((image.shape[0], image.shape[1] * 3 + 1),
+                       dtype=numpy.uint8)
+    rows[:, 1:] = image.reshape(image.shape[0], -1)
+    return zlib.compress(rows.tostring(), level)
+
+
+def _header(image):
+    "Returns the PNG signature and IHDR chunk for an RGB IMAGE."
+    return '\x89PNG\r\n\x1a\n' + _chunk(
+        'IHDR', struct.pack('>IIBBBBB', image.shape[1], image.shape[0],
+                            8, 2, 0, 0, 0))
+
+
+def writePNG(path, image, level=1):
+    """
+    Writes an RGB IMAGE (a uint8 array of shape (rows, columns, 3)) to PATH
+    as a PNG file.
+    """
+    with open(path, 'wb') as f:
+        f.write(_header(image))
+        f.write(_chunk('IDAT', _compress(image, level)))
+        f.write(_chunk('IEND', ''))
+
+
+class APNGWriter(object):
+    """
+    An APNGWriter streams RGB frames into an animated PNG file, which most
+    browsers play directly.
+    """
+    def __init__(self, path, fps=25, level=1):
+        """
+        Opens PATH for writing.
+
+        fps: frames per second of the animation (an int > 0)
+        level: zlib compression level (an int, 1 is fastest)
+        """
+        self.f = open(path, 'wb')
+        self.fps = fps
+        self.level = level
+        self.num_frames = 0
+        self.sequence = 0
+        self.actl_offset = None
+
+    def write(self, image):
+        """
+        Appends the RGB IMAGE as the next frame. All frames must have the
+        same size.
+        """
+        if self.actl_offset is None:
+            self.f.write(_header(image))
+            self.actl_offset = self.f.tell()
+            # The frame count is patched in by close()
+            self.f.write(_chunk('acTL', struct.pack('>II', 0, 0)))
+        self.f.write(_chunk('fcTL', struct.pack(
+            '>IIIIIHHBB', self.sequence, image.shape[1], image.shape[0],
+            0, 0, 1, self.fps, 0, 0)))
+        self.sequence += 1
+        data = _compress(image, self.level)
+        if self.num_frames == 0:
+            self.f.write(_chunk('IDAT', data))
+        else:
+            self.f.write(_chunk('fdAT', struct.pack('>I', self.sequence) +
+                                data))
+            self.sequence += 1
+        self.num_frames += 1
+
+    def close(self):
+        "Writes the frame count and closes the file."
+        self.f.write(_chunk('IEND', ''))
+        if self.actl_offset is not None:
+            self.f.seek(self.actl_offset)
+            self.f.write(_chunk('acTL', struct.pack('>II', self.num_frames, 0)))
+        self.f.close()
+
+
+class FrameRenderer(object):
+    """
+    A FrameRenderer rasterizes a robot run into one reused RGB image buffer.
+
+    Each tile is SCALE x SCALE pixels, dirty tiles gray and clean tiles white;
+    robots are black squares with a red pixel in front showing their
+    direction. Every drawn frame is passed to the optional SINK: a path
+    pattern such as 'frames/%05d.png' writes an image sequence, any other
+    path ending in '.png' writes one animated PNG, and a callable is called
+    with the buffer.
+    """
+    def __init__(self, num_robots, width, height, scale=4, sink=None,
+                 every=1, fps=25):
+        """
+        Initializes a renderer for NUM_ROBOTS robots in a WIDTH x HEIGHT room.
+
+        scale: pixels per tile side (an int > 0)
+        sink: a path pattern, an animated PNG path, a callable, or None
+        every: only every Nth call to update() is drawn (an int > 0)
+        fps: frame rate of an animated PNG sink (an int > 0)
+        """
+        self.num_robots = num_robots
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.every = every
+        self.time = 0
+        self.num_frames = 0
+        # Row 0 is the top of the room (largest y)
+        self.frame = numpy.empty((height * scale, width * scale, 3),
+                                 dtype=numpy.uint8)
+        self.frame[:] = DIRTY
+        self.dirty = set((i, j) for i in range(width) for j in range(height))
+        self.cleaned = CleanedTileTracker(width, height)
+        self.robot_pixels = []
+        self.writer = None
+        self.sink = sink
+        if isinstance(sink, str) and not sink.lower().endswith('.png'):
+            raise ValueError("sink %r is not a path ending in '.png'" % sink)
+        if isinstance(sink, str) and '%' not in sink:
+            self.writer = APNGWriter(sink, fps)
+        elif isinstance(sink, str):
+            directory = os.path.dirname(sink)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    def _tile_slice(self, i, j):
+        "Returns the pixel rows and columns of tile (i, j)."
+        s = self.scale
+        row = (self.height - 1 - j) * s
+        return slice(row, row + s), slice(i * s, i * s + s)
+
+    def _pixel(self, x, y):
+        "Maps a room position to the (row, column) of its pixel."
+        s = self.scale
+        row = min(max(int((self.height - y) * s), 0), self.height * s - 1)
+        column = min(max(int(x * s), 0), self.width * s - 1)
+        return row, column
+
+    def _background(self, row, column):
+        "Returns the tile color under pixel (row, column)."
+        tile = (column // self.scale, self.height - 1 - row // self.scale)
+        if tile in self.dirty:
+            return DIRTY
+        return CLEAN
+
+    def update(self, room, robots):
+        "Draws the frame for the specified room and robot state."
+        self.time += 1
+        if self.time % self.every:
+            return
+        frame = self.frame
+        # Erase the robots of the previous frame
+        for row, column in self.robot_pixels:
+            frame[row, column] = self._background(row, column)
+        for tile in self.cleaned.new_tiles(room):
+            if tile in self.dirty:
+                self.dirty.discard(tile)
+                rows, columns = self._tile_slice(*tile)
+                frame[rows, columns] = CLEAN
+        # Draw the robots, remembering the pixels they cover
+        self.robot_pixels = []
+        half = max(self.scale // 4, 0)
+        limit_r, limit_c = frame.shape[0] - 1, frame.shape[1] - 1
+        for robot in robots:
+            row, column = self._pixel(robot.position.x, robot.position.y)
+            for r in range(max(row - half, 0), min(row + half, limit_r) + 1):
+                for c in range(max(column - half, 0),
+                               min(column + half, limit_c) + 1):
+                    frame[r, c] = BODY
+                    self.robot_pixels.append((r, c))
+            angle = math.radians(robot.direction)
+            r, c = self._pixel(
+                robot.position.x + (half + 1.0) / self.scale * math.sin(angle),
+                robot.position.y + (half + 1.0) / self.scale * math.cos(angle))
+            frame[r, c] = ARROW
+            self.robot_pixels.append((r, c))
+        self._emit()
+
+    def _emit(self):
+        "Hands the current frame to the sink."
+        if self.writer is not None:
+            self.writer.write(self.frame)
+        elif isinstance(self.sink, str):
+            writePNG(self.sink % self.num_frames, self.frame)
+        elif self.sink is not None:
+            self.sink(self.frame)
+        self.num_frames += 1
+
+    def done(self):
+        "Finishes the output (closes an animated PNG)."
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
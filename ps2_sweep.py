@@ -0,0 +1,165 @@
+# Problem Set 2:
+# On-disk result cache for runSimulation parameter sweeps.
+#
+# Each (num_robots, speed, width, height, min_coverage, robot_type, seed,
+# trials) cell of a sweep is stored in a sqlite database, so re-plotting a
+# figure only runs the cells that are missing.
+
+import hashlib
+import inspect
+import sqlite3
+import time
+
+import ps2
+
+
+_codeHashes = {}
+
+
+def _hashSource(digest, obj, members):
+    """
+    Adds the source code of OBJ (a class or function) to DIGEST, or, if
+    there is no source (e.g. only bytecode), the bytecode of the functions
+    in MEMBERS (a dict from names to objects).
+    """
+    try:
+        digest.update(inspect.getsource(obj).encode('utf-8'))
+    except (IOError, TypeError):
+        for name in sorted(members):
+            code = getattr(members[name], '__code__', None)
+            if code is not None:
+                digest.update(name.encode('utf-8'))
+                digest.update(code.co_code)
+
+
+def robotCodeHash(robot_type):
+    """
+    Returns a hex digest of the source code of ROBOT_TYPE and of every class
+    it inherits from, so that cached results are dropped when the way a
+    robot moves changes.
+
+    robot_type: a Robot subclass
+    """
+    if robot_type in _codeHashes:
+        return _codeHashes[robot_type]
+    digest = hashlib.sha1()
+    for cls in inspect.getmro(robot_type):
+        if cls is not object:
+            _hashSource(digest, cls, vars(cls))
+    _codeHashes[robot_type] = digest.hexdigest()
+    return _codeHashes[robot_type]
+
+
+class SweepCache(object):
+    """
+    A SweepCache stores the results of runSimulation calls in a sqlite
+    database, keeping at most MAX_ENTRIES results and evicting the ones used
+    least recently.
+    """
+    def __init__(self, path, max_entries=100000):
+        """
+        Opens (or creates) the cache stored in the file PATH.
+
+        path: file name of the sqlite database (a string), or ':memory:'
+        max_entries: maximum number of cached results (an int > 0)
+        """
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results ("
+                        "key TEXT PRIMARY KEY, value REAL NOT NULL, "
+                        "used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_used "
+                        "ON results (used)")
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def makeKey(self, num_robots, speed, width, height, min_coverage,
+                num_trials, robot_type, seed, streams=None,
+                room_type=ps2.RectangularRoom):
+        """
+        Returns the cache key of a runSimulation cell (a string).
+
+        num_robots: an int, or a fleet spec (see ps2.fleetSpec)
+        streams: the stream factory passed to runSimulation, or None
+        room_type: the room type passed to runSimulation (see
+                   ps2.roomTypeKey)
+        """
+        if isinstance(num_robots, (list, tuple)):
+            fleet = tuple((group_type.__name__, robotCodeHash(group_type),
+                           float(group_speed), count)
+                          for group_type, group_speed, count
+                          in ps2.fleetSpec(num_robots, speed, robot_type))
+            key = (fleet, width, height, float(min_coverage), num_trials,
+                   seed)
+        else:
+            key = (num_robots, float(speed), width, height,
+                   float(min_coverage), num_trials, robot_type.__name__,
+                   robotCodeHash(robot_type), seed)
+        if streams is not None:
+            key += (streams.__name__,)
+        if room_type is not ps2.RectangularRoom:
+            # Left out for the default room, so older entries stay valid
+            key += (ps2.roomTypeKey(room_type),)
+        return repr(key)
+
+    def get(self, key):
+        """
+        Returns the value cached under KEY, or None if there is none.
+        """
+        row = self.db.execute("SELECT value FROM results WHERE key = ?",
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE results SET used = ? WHERE key = ?",
+                        (time.time(), key))
+        self.db.commit()
+        return row[0]
+
+    def put(self, key, value):
+        """
+        Caches VALUE under KEY, evicting the least recently used entries if
+        the cache is full.
+        """
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                        (key, value, time.time()))
+        excess = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0] \
+                 - self.max_entries
+        if excess > 0:
+            self.db.execute("DELETE FROM results WHERE key IN (SELECT key "
+                            "FROM results ORDER BY used LIMIT ?)", (excess,))
+        self.db.commit()
+
+    def runSimulation(self, num_robots, speed, width, height, min_coverage,
+                      num_trials, robot_type, seed=None, **kwargs):
+        """
+        Returns the cached result of ps2.runSimulation with these arguments,
+        running it (and caching the result) only if it is missing.
+
+        Extra keyword arguments (room_type, workers, pool, event_driven,
+        tile_stats, checkpoint, checkpoint_interval, streams) are passed on
+        to ps2.runSimulation. The room type and the streams change the
+        result and are part of the key; the others only change how the
+        trials are run (event-driven trials take the same steps), so they
+        are not.
+        """
+        key = self.makeKey(num_robots, speed, width, height, min_coverage,
+                           num_trials, robot_type, seed,
+                           kwargs.get('streams'),
+                           kwargs.get('room_type', ps2.RectangularRoom))
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = ps2.runSimulation(num_robots, speed, width, height,
+                                  min_coverage, num_trials, robot_type,
+                                  seed=seed, **kwargs)
+        self.put(key, value)
+        return value
+
+    def close(self):
+        """
+        Closes the underlying database.
+        """
+        self.db.close()
@@ -0,0 +1,156 @@
+# Problem Set 2:
+# Binary trajectory log for simulated robots.
+#
+# A TrajectoryRecorder is passed to ps2.runTrial like a visualization and
+# appends the robots' state and the newly cleaned tiles of every time-step,
+# up to and including the state the run finished in, to a file of
+# fixed-width records. A TrajectoryLog memory-maps that file and
+# replays it, from any time-step and at any speed, into any object with the
+# update(room, robots)/done() interface of ps2_visualize.RobotVisualization.
+
+import struct
+import time
+
+import numpy
+
+import ps2
+from ps2_visualize import CleanedTileTracker
+
+
+MAGIC = 'PS2TRAJ1'
+HEADER = struct.Struct('<8sIII4x')
+
+# One record per robot per time-step (robot >= 0) and one per newly cleaned
+# tile (robot == -1, with the tile (m, n) stored in x and y)
+RECORD = numpy.dtype([('step', '<u4'), ('robot', '<i2'),
+                      ('direction', '<i2'), ('x', '<f8'), ('y', '<f8')])
+
+
+class TrajectoryRecorder(object):
+    """
+    A TrajectoryRecorder streams a robot run into an append-only log file.
+    """
+    def __init__(self, path, num_robots, width, height):
+        """
+        Creates the log file PATH for NUM_ROBOTS robots in a WIDTH x HEIGHT
+        room.
+        """
+        self.f = open(path, 'wb')
+        self.f.write(HEADER.pack(MAGIC, num_robots, width, height))
+        self.num_robots = num_robots
+        self.width = width
+        self.height = height
+        self.step = 0
+        self.cleaned = CleanedTileTracker(width, height)
+
+    def update(self, room, robots):
+        "Records the room and robot state of the current time-step."
+        tiles = self.cleaned.new_tiles(room)
+        records = numpy.zeros(len(robots) + len(tiles), dtype=RECORD)
+        records['step'] = self.step
+        for i, robot in enumerate(robots):
+            records[i] = (self.step, i, robot.direction,
+                          robot.position.x, robot.position.y)
+        if tiles:
+            tiles = numpy.array(tiles, dtype=float)
+            records['robot'][len(robots):] = -1
+            records['x'][len(robots):] = tiles[:, 0]
+            records['y'][len(robots):] = tiles[:, 1]
+        self.f.write(records.tostring())
+        self.step += 1
+
+    def done(self):
+        "Closes the log file."
+        self.f.close()
+
+
+class ReplayRobot(object):
+    """
+    The position and direction of a robot read back from a log, enough for
+    the visualizers.
+    """
+    def __init__(self, x, y, direction):
+        self.position = ps2.Position(x, y)
+        self.direction = direction
+
+
+class TrajectoryLog(object):
+    """
+    A TrajectoryLog gives random access to a log written by a
+    TrajectoryRecorder, without re-running the simulation.
+    """
+    def __init__(self, path):
+        """
+        Memory-maps the log file PATH.
+        """
+        with open(path, 'rb') as f:
+            magic, self.num_robots, self.width, self.height = \
+                HEADER.unpack(f.read(HEADER.size))
+            f.seek(0, 2)
+            size = f.tell() - HEADER.size
+        if magic != MAGIC:
+            raise ValueError("%s is not a robot trajectory log" % path)
+        if size < RECORD.itemsize:
+            self.records = numpy.zeros(0, dtype=RECORD)
+        else:
+            self.records = numpy.memmap(path, dtype=RECORD, mode='r',
+                                        offset=HEADER.size,
+                                        shape=(size // RECORD.itemsize,))
+        self.steps = self.records['step']
+
+    def getNumSteps(self):
+        """
+        Returns the number of recorded time-steps. A finished run of n
+        time-steps records n + 1: the start of each step, then the end.
+        """
+        if len(self.steps) == 0:
+            return 0
+        return int(self.steps[-1]) + 1
+
+    def _span(self, first, last):
+        "Returns the records of time-steps FIRST to LAST - 1."
+        lo = numpy.searchsorted(self.steps, first, 'left')
+        hi = numpy.searchsorted(self.steps, last, 'left')
+        return self.records[lo:hi]
+
+    def _clean(self, room, records):
+        "Cleans the tiles logged in RECORDS in ROOM."
+        tiles = records[records['robot'] < 0]
+        if len(tiles):
+            room.cleanTileIndices(tiles['x'].astype(numpy.intp) * room.height +
+                                  tiles['y'].astype(numpy.intp))
+
+    def _robots(self, records):
+        "Returns the ReplayRobots logged in RECORDS."
+        robots = records[records['robot'] >= 0]
+        return [ReplayRobot(float(r['x']), float(r['y']), int(r['direction']))
+                for r in robots]
+
+    def getState(self, step):
+        """
+        Returns (room, robots) as they were at time-step STEP: a
+        ps2.BitmapRoom with the tiles cleaned so far and a list of
+        ReplayRobots.
+        """
+        room = ps2.BitmapRoom(self.width, self.height)
+        self._clean(room, self._span(0, step + 1))
+        return room, self._robots(self._span(step, step + 1))
+
+    def replay(self, anim, start=0, stop=None, every=1, delay=0.0):
+        """
+        Feeds time-steps START to STOP - 1 to ANIM, an object with
+        update(room, robots) and done() methods, then calls anim.done().
+
+        every: only every Nth time-step is shown (an int > 0)
+        delay: seconds to wait between shown time-steps (a float)
+        """
+        if stop is None:
+            stop = self.getNumSteps()
+        room = ps2.BitmapRoom(self.width, self.height)
+        self._clean(room, self._span(0, start))
+        for step in range(start, stop, every):
+            self._clean(room, self._span(max(step - every + 1, start), step + 1))
+            anim.update(room, self._robots(self._span(step, step + 1)))
+            if delay:
+                time.sleep(delay)
+        anim.done()
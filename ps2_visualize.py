@@ -6,13 +6,50 @@
 import math
 import time
 
-from Tkinter import *
+
+def _tkinter():
+    "Returns the Tkinter module, importing it on first use (needs a display)."
+    import Tkinter
+    return Tkinter
+
+
+class CleanedTileTracker(object):
+    """
+    Follows the tiles a room cleans, so that a visualization or recorder only
+    handles the tiles cleaned since its last frame.
+    """
+    def __init__(self, width, height):
+        "Initializes a tracker for a WIDTH x HEIGHT room with no tiles seen."
+        self.width = width
+        self.height = height
+        self.num_cleaned = 0
+        # Tiles not yet seen cleaned, for rooms without a log of cleanings
+        self.dirty = None
+
+    def new_tiles(self, room):
+        "Returns the tiles (m, n) cleaned in ROOM since the last call."
+        if hasattr(room, 'logCleanedTiles'):
+            # Have the room log tiles in the order they are cleaned
+            room.logCleanedTiles()
+            cleaned = room.getCleanedTilesSince(self.num_cleaned)
+            self.num_cleaned += len(cleaned)
+            return cleaned
+        if self.dirty is None:
+            self.dirty = set((i, j) for i in range(self.width)
+                             for j in range(self.height))
+        cleaned = [tile for tile in self.dirty if room.isTileCleaned(*tile)]
+        self.dirty.difference_update(cleaned)
+        return cleaned
+
 
 class RobotVisualization:
-    def __init__(self, num_robots, width, height, delay = 0.2):
+    def __init__(self, num_robots, width, height, delay = 0.2, every = 1):
         "Initializes a visualization with the specified parameters."
+        self.tk = _tkinter()
         # Number of seconds to pause after each frame
         self.delay = delay
+        # Only every Nth call to update() is drawn
+        self.every = every
 
         self.max_dim = max(width, height)
         self.width = width
@@ -20,8 +57,8 @@ class RobotVisualization:
         self.num_robots = num_robots
 
         # Initialize a drawing surface
-        self.master = Tk()
-        self.w = Canvas(self.master, width=500, height=500)
+        self.master = self.tk.Tk()
+        self.w = self.tk.Canvas(self.master, width=500, height=500)
         self.w.pack()
         self.master.update()
 
@@ -30,8 +67,10 @@ class RobotVisualization:
         x2, y2 = self._map_coords(width, height)
         self.w.create_rectangle(x1, y1, x2, y2, fill = "white")
 
-        # Draw gray squares for dirty tiles
+        # Draw gray squares for dirty tiles (removed from self.tiles once
+        # they have been deleted)
         self.tiles = {}
+        self.cleaned = CleanedTileTracker(width, height)
         for i in range(width):
             for j in range(height):
                 x1, y1 = self._map_coords(i, j)
@@ -51,7 +90,7 @@ class RobotVisualization:
 
         # Draw some status text
         self.robots = None
-        self.text = self.w.create_text(25, 0, anchor=NW,
+        self.text = self.w.create_text(25, 0, anchor=self.tk.NW,
                                        text=self._status_string(0, 0))
         self.time = 0
         self.master.update()
@@ -67,51 +106,56 @@ class RobotVisualization:
         return (250 + 450 * ((x - self.width / 2.0) / self.max_dim),
                 250 + 450 * ((self.height / 2.0 - y) / self.max_dim))
 
-    def _draw_robot(self, position, direction):
-        "Returns a polygon representing a robot with the specified parameters."
+    def _robot_coords(self, position, direction):
+        "Returns the canvas coordinates of a robot's body and of its arrow."
         x, y = position.x, position.y
         d1 = direction + 165
         d2 = direction - 165
+        x1, y1 = self._map_coords(x - 0.08, y - 0.08)
+        x2, y2 = self._map_coords(x + 0.08, y + 0.08)
+        body = [x1, y1, x2, y2]
         x1, y1 = self._map_coords(x, y)
         x2, y2 = self._map_coords(x + 0.6 * math.sin(math.radians(d1)),
                                   y + 0.6 * math.cos(math.radians(d1)))
         x3, y3 = self._map_coords(x + 0.6 * math.sin(math.radians(d2)),
                                   y + 0.6 * math.cos(math.radians(d2)))
-        return self.w.create_polygon([x1, y1, x2, y2, x3, y3], fill="red")
+        return body, [x1, y1, x2, y2, x3, y3]
 
     def update(self, room, robots):
         "Redraws the visualization with the specified room and robot state."
-        # Removes a gray square for any tiles have been cleaned.
-        for i in range(self.width):
-            for j in range(self.height):
-                if room.isTileCleaned(i, j):
-                    self.w.delete(self.tiles[(i, j)])
-        # Delete all existing robots.
-        if self.robots:
-            for robot in self.robots:
-                self.w.delete(robot)
-                self.master.update_idletasks()
-        # Draw new robots
-        self.robots = []
-        for robot in robots:
-            pos = robot.position
-            x, y = pos.x, pos.y
-            x1, y1 = self._map_coords(x - 0.08, y - 0.08)
-            x2, y2 = self._map_coords(x + 0.08, y + 0.08)
-            self.robots.append(self.w.create_oval(x1, y1, x2, y2,
-                                                  fill = "black"))
-            self.robots.append(
-                self._draw_robot(robot.position, robot.direction))
-        # Update text
-        self.w.delete(self.text)
         self.time += 1
-        self.text = self.w.create_text(
-            25, 0, anchor=NW,
+        if self.time % self.every:
+            return
+        # Removes the gray squares of tiles cleaned since the last frame.
+        for tile in self.cleaned.new_tiles(room):
+            if tile in self.tiles:
+                self.w.delete(self.tiles.pop(tile))
+        # Move the existing robots, drawing them the first time.
+        if self.robots is not None and len(self.robots) != 2 * len(robots):
+            for item in self.robots:
+                self.w.delete(item)
+            self.robots = None
+        if self.robots is None:
+            self.robots = []
+            for robot in robots:
+                body, arrow = self._robot_coords(robot.position,
+                                                 robot.direction)
+                self.robots.append(self.w.create_oval(body, fill = "black"))
+                self.robots.append(self.w.create_polygon(arrow, fill="red"))
+        else:
+            for i, robot in enumerate(robots):
+                body, arrow = self._robot_coords(robot.position,
+                                                 robot.direction)
+                self.w.coords(self.robots[2 * i], *body)
+                self.w.coords(self.robots[2 * i + 1], *arrow)
+        # Update text
+        self.w.itemconfig(
+            self.text,
             text=self._status_string(self.time, room.getNumCleanedTiles()))
         self.master.update()
         time.sleep(self.delay)
 
     def done(self):
         "Indicate that the animation is done so that we allow the user to close the window."
-        mainloop()
+        self.tk.mainloop()
 
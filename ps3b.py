@@ -3,7 +3,12 @@
 import numpy
 import random
 import pylab
+import collections
 import copy
+import itertools
+
+import ps_checkpoint
+import ps_kernels
 
 
 
@@ -19,6 +24,102 @@ class NoChildException(Exception):
     modify/add any code.
     """
 
+def _sharedRNG(population, virus_type):
+    """
+    Returns the random stream shared by all particles of POPULATION (a
+    VirusPopulation) if they are all of exactly VIRUS_TYPE (the random
+    module for an empty population), or None otherwise.
+    """
+    viruses = population.getParticles()
+    rng = viruses[0].rng if len(viruses) else random
+    for virus in viruses:
+        if type(virus) is not virus_type or virus.rng is not rng:
+            return None
+    return rng
+
+
+# The drug registry: every drug a ResistantVirus is constructed with gets a
+# bit, in the order the drugs are first seen; a genotype is the bitmask of
+# the drugs a particle resists. Genotypes are Python ints (kept in object
+# arrays), so there is no limit on the number of drugs.
+_DRUG_BITS = {}
+
+
+def drugMask(drugs, register=True):
+    """
+    Returns the bitmask of DRUGS (an iterable of drug names), registering
+    the drugs not seen before.
+
+    register: if False, nothing is registered, and None is returned if a
+    drug has not been seen (no particle can resist it)
+    """
+    mask = 0
+    for drug in drugs:
+        bit = _DRUG_BITS.get(drug)
+        if bit is None:
+            if not register:
+                return None
+            bit = _DRUG_BITS[drug] = 1 << len(_DRUG_BITS)
+        mask |= bit
+    return mask
+
+
+class _Resistances(dict):
+    """
+    The resistances of a ResistantVirus: a dict that cannot be changed, so
+    that the particle's genotype always matches it. Copies (copy.copy,
+    copy.deepcopy, .copy()) are plain dicts.
+    """
+
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError("the resistances of a virus particle cannot change")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _readOnly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict((copy.deepcopy(drug, memo), copy.deepcopy(value, memo))
+                    for drug, value in self.iteritems())
+
+    def __reduce__(self):
+        return (_Resistances, (dict(self),))
+
+
+def _reproduceEach(viruses, popDensity, activeDrugs):
+    """
+    Calls reproduce() on each particle of VIRUSES, passing ACTIVEDRUGS
+    unless it is None, and returns the offspring (a list). The fallback of
+    reproduceMany() for classes that override reproduce() only.
+    """
+    args = (popDensity,) if activeDrugs is None else (popDensity, activeDrugs)
+    offspring = []
+    for virus in viruses:
+        try:
+            offspring.append(virus.reproduce(*args))
+        except NoChildException:
+            continue
+    return offspring
+
+
+def _streamsName(streams):
+    """
+    Returns the name of the stream factory STREAMS (None for no factory).
+    """
+    return None if streams is None else streams.__name__
+
+
+def _clearedMask(population, rng):
+    """
+    Draws clearance for each particle of POPULATION (a VirusPopulation) in
+    order from RNG, as doesClear() would, and returns a bool array that is
+    True for the particles that are cleared.
+    """
+    return ps_kernels.uniforms(len(population), rng) < \
+           population.getClearProbs()
+
 '''
 End helper code
 '''
@@ -32,15 +133,23 @@ class SimpleVirus(object):
     """
     Representation of a simple virus (does not model drug effects/resistance).
     """
-    def __init__(self, maxBirthProb, clearProb):
+
+    # The bitmask of the drugs this particle resists (see drugMask)
+    genotype = 0
+
+    def __init__(self, maxBirthProb, clearProb, rng=random):
         """
         Initialize a SimpleVirus instance, saves all parameters as attributes
         of the instance.        
         maxBirthProb: Maximum reproduction probability (a float between 0-1)        
         clearProb: Maximum clearance probability (a float between 0-1).
+        rng: where the particle and its offspring draw their random numbers
+        from (the random module, or e.g. a ps_random.CounterStream shared by
+        the population of one patient)
         """
         self.maxBirthProb = float(maxBirthProb)
         self.clearProb = float(clearProb)
+        self.rng = rng
 
 
     def doesClear(self):
@@ -50,7 +159,7 @@ class SimpleVirus(object):
         False.
         """
 
-        return random.random() < self.clearProb
+        return self.rng.random() < self.clearProb
 
     
     def reproduce(self, popDensity):
@@ -73,12 +182,300 @@ class SimpleVirus(object):
         NoChildException if this virus particle does not reproduce.               
         """
 
-        if random.random() < self.maxBirthProb * (1 - popDensity):
-            return SimpleVirus(self.maxBirthProb, self.clearProb)
+        if self.rng.random() < self.maxBirthProb * (1 - popDensity):
+            return SimpleVirus(self.maxBirthProb, self.clearProb, self.rng)
         else:
             raise NoChildException
 
 
+    @classmethod
+    def reproduceMany(cls, viruses, popDensity, activeDrugs=None):
+        """
+        Calls reproduce() for each particle of VIRUSES (instances of this
+        class), in order, and returns the offspring: the same draws and the
+        same offspring, without a NoChildException for each particle that
+        does not reproduce.
+
+        viruses: the parent particles (a list)
+
+        popDensity: the population density (a float)
+
+        activeDrugs: the drugs acting on the particles (a list of strings,
+        or None outside a TreatedPatient); SimpleViruses ignore them
+
+        returns: the offspring (a list), in the order of their parents
+        """
+        if cls.reproduce.im_func is not SimpleVirus.reproduce.im_func:
+            return _reproduceEach(viruses, popDensity, activeDrugs)
+        offspring = []
+        for virus in viruses:
+            if virus.rng.random() < virus.maxBirthProb * (1 - popDensity):
+                offspring.append(SimpleVirus(virus.maxBirthProb,
+                                             virus.clearProb, virus.rng))
+        return offspring
+
+
+
+class VirusPopulation(object):
+    """
+    The virus particles of a patient, kept in preallocated NumPy arrays: the
+    particles themselves and, as columns, their clearProb, maxBirthProb and
+    genotype. Cleared particles are removed by compacting the arrays with a
+    survival mask, and offspring are appended in bulk, the capacity
+    doubling when it runs out. The number of live particles of each
+    genotype is kept up to date as particles are added and removed.
+    """
+
+    def __init__(self, viruses=()):
+        """
+        viruses: the initial particles (a list of SimpleVirus instances)
+        """
+        viruses = list(viruses)
+        capacity = max(len(viruses), 16)
+        self.size = 0
+        self.particles = numpy.empty(capacity, dtype=object)
+        self.clearProbs = numpy.empty(capacity, dtype=float)
+        self.birthProbs = numpy.empty(capacity, dtype=float)
+        self.genotypes = numpy.empty(capacity, dtype=object)
+        self.genotypeCounts = {}
+        self.extend(viruses)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+
+    def tolist(self):
+        """
+        Returns the particles, in order (a new list).
+        """
+        return self.particles[:self.size].tolist()
+
+
+    def getParticles(self):
+        """
+        Returns the particles as an object array (a view, valid until the
+        population changes).
+        """
+        return self.particles[:self.size]
+
+
+    def getClearProbs(self):
+        """
+        Returns the clearProb of each particle (a float array view).
+        """
+        return self.clearProbs[:self.size]
+
+
+    def getBirthProbs(self):
+        """
+        Returns the maxBirthProb of each particle (a float array view).
+        """
+        return self.birthProbs[:self.size]
+
+
+    def getGenotypes(self):
+        """
+        Returns the genotype of each particle (an object array view of
+        ints).
+        """
+        return self.genotypes[:self.size]
+
+
+    def getGenotypeCounts(self):
+        """
+        Returns a dict from each genotype with live particles to their
+        number. The dict is the population's own and must not be changed.
+        """
+        return self.genotypeCounts
+
+
+    def _count(self, genotypes, sign):
+        "Adds SIGN (1 or -1) times the particles of GENOTYPES to the counts."
+        counts = self.genotypeCounts
+        values, numbers = numpy.unique(genotypes, return_counts=True)
+        for genotype, number in zip(values.tolist(), numbers.tolist()):
+            number = counts.get(genotype, 0) + sign * number
+            if number:
+                counts[genotype] = number
+            else:
+                del counts[genotype]
+
+
+    def _reserve(self, size):
+        "Grows the arrays geometrically until they can hold SIZE particles."
+        capacity = len(self.particles)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ('particles', 'clearProbs', 'birthProbs', 'genotypes'):
+            old = getattr(self, name)
+            new = numpy.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+
+    def extend(self, viruses):
+        """
+        Appends the particles VIRUSES (a list) after the current ones.
+        """
+        end = self.size + len(viruses)
+        self._reserve(end)
+        self.particles[self.size:end] = viruses
+        self.clearProbs[self.size:end] = [virus.clearProb
+                                          for virus in viruses]
+        self.birthProbs[self.size:end] = [virus.maxBirthProb
+                                          for virus in viruses]
+        self.genotypes[self.size:end] = [virus.genotype for virus in viruses]
+        self._count(self.genotypes[self.size:end], 1)
+        self.size = end
+
+
+    def keep(self, mask):
+        """
+        Removes the particles for which MASK (a bool array, one entry per
+        particle) is False, keeping the others in order.
+        """
+        mask = numpy.asarray(mask, dtype=bool)
+        kept = int(numpy.count_nonzero(mask))
+        if kept < self.size:
+            self._count(self.genotypes[:self.size][~mask], -1)
+        for array in (self.particles, self.clearProbs, self.birthProbs,
+                      self.genotypes):
+            array[:kept] = array[:self.size][mask]
+        # Release the removed particles
+        self.particles[kept:self.size] = None
+        self.size = kept
+
+
+    def splice(self, start, stop, viruses):
+        """
+        Replaces the particles START to STOP - 1 with VIRUSES (a list), like
+        a list slice assignment. Only the particles from START on are moved.
+        """
+        tail = self.particles[stop:self.size].tolist()
+        mask = numpy.zeros(self.size, dtype=bool)
+        mask[:start] = True
+        self.keep(mask)
+        self.extend(list(viruses) + tail)
+
+
+
+class VirusList(collections.MutableSequence):
+    """
+    The viruses of a Patient as a list: a view of its VirusPopulation.
+    Reading it shows the current particles, and changing it (append,
+    remove, item and slice assignment, ...) changes the population.
+    """
+
+    def __init__(self, patient):
+        """
+        patient: the Patient whose population is shown
+        """
+        self.patient = patient
+
+
+    def _index(self, index):
+        "Returns the int INDEX as a position in 0..len - 1."
+        size = len(self)
+        position = index + size if index < 0 else index
+        if not 0 <= position < size:
+            raise IndexError("list index out of range")
+        return position
+
+
+    def __len__(self):
+        return len(self.patient.population)
+
+
+    def __iter__(self):
+        # Iterates over the particles present when the loop starts
+        return iter(self.patient.population.tolist())
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.patient.population.tolist()[index]
+        return self.patient.population.getParticles()[self._index(index)]
+
+
+    def __setitem__(self, index, value):
+        population = self.patient.population
+        if not isinstance(index, slice):
+            position = self._index(index)
+            population.splice(position, position + 1, [value])
+        elif index.step in (None, 1):
+            start, stop, step = index.indices(len(self))
+            population.splice(start, max(start, stop), list(value))
+        else:
+            viruses = population.tolist()
+            viruses[index] = value
+            population.splice(0, len(population), viruses)
+
+
+    def __delitem__(self, index):
+        population = self.patient.population
+        if not isinstance(index, slice):
+            position = self._index(index)
+            population.splice(position, position + 1, [])
+        else:
+            viruses = population.tolist()
+            del viruses[index]
+            population.splice(0, len(population), viruses)
+
+
+    def insert(self, index, value):
+        size = len(self)
+        position = max(index + size, 0) if index < 0 else min(index, size)
+        self.patient.population.splice(position, position, [value])
+
+
+    def append(self, value):
+        self.patient.population.extend([value])
+
+
+    def extend(self, values):
+        self.patient.population.extend(list(values))
+
+
+    def reverse(self):
+        population = self.patient.population
+        population.splice(0, len(population), population.tolist()[::-1])
+
+
+    def sort(self, *args, **kwargs):
+        population = self.patient.population
+        viruses = population.tolist()
+        viruses.sort(*args, **kwargs)
+        population.splice(0, len(population), viruses)
+
+
+    def __add__(self, other):
+        return self[:] + list(other)
+
+
+    def __eq__(self, other):
+        if isinstance(other, VirusList):
+            other = other[:]
+        return self[:] == other
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    __hash__ = None
+
+
+    def __repr__(self):
+        return repr(self[:])
+
+
 
 class Patient(object):
     """
@@ -97,17 +494,35 @@ class Patient(object):
         maxPop: the maximum virus population for this patient (an integer)
         """
 
-        self.viruses = viruses
+        self.population = VirusPopulation(viruses)
         self.maxPop = maxPop
 
 
+    def getViruses(self):
+        """
+        Returns the virus particles as a VirusList: a list-like view whose
+        changes (e.g. append or remove) are made to the population.
+        """
+        return VirusList(self)
+
+
+    def setViruses(self, viruses):
+        """
+        Replaces the virus population with VIRUSES (a list of particles).
+        """
+        self.population = VirusPopulation(viruses)
+
+
+    viruses = property(getViruses, setViruses)
+
+
     def getTotalPop(self):
         """
         Gets the size of the current total virus population. 
         returns: The total virus population (an integer)
         """
 
-        return len(self.viruses)
+        return len(self.population)
 
 
     def update(self):
@@ -128,32 +543,114 @@ class Patient(object):
         returns: The total virus population at the end of the update (an
         integer)
         """
+        if ps_kernels.useKernels():
+            rng = _sharedRNG(self.population, SimpleVirus)
+            if rng is not None:
+                return self._updateWithKernels(rng)
+
         #step 1
-        viruses_copy = self.viruses[:]
-        for virus in viruses_copy:
-            if virus.doesClear():
-                self.viruses.remove(virus)
+        self.population.keep([not virus.doesClear()
+                              for virus in self.population])
                 
         #step 2
         popDensity = self.getTotalPop()/float(self.maxPop)
         
         #step 3
-        viruses_copy2 = self.viruses[:]
-        for virus in viruses_copy2:
-            try:
-                offspring = virus.reproduce(popDensity)
-                self.viruses.append(offspring)
-            except NoChildException:
-                continue
+        offspring = []
+        for virus_type, viruses in itertools.groupby(self.population, type):
+            offspring.extend(virus_type.reproduceMany(list(viruses),
+                                                      popDensity))
+        self.population.extend(offspring)
                 
         return self.getTotalPop()
 
 
+    def _updateWithKernels(self, rng):
+        """
+        update() for a population of SimpleViruses sharing the random stream
+        RNG, with the draws of each step made in one block and compared as
+        arrays. Gives the same population, in the same order, and leaves RNG
+        in the same state as update().
+        """
+        population = self.population
+        population.keep(~_clearedMask(population, rng))
+        popDensity = len(population)/float(self.maxPop)
+        born = ps_kernels.uniforms(len(population), rng) < \
+               population.getBirthProbs() * (1 - popDensity)
+        population.extend([
+            SimpleVirus(virus.maxBirthProb, virus.clearProb, rng)
+            for virus in population.getParticles()[born].tolist()])
+        return self.getTotalPop()
+
+
+class AggregatePatient(object):
+    """
+    A patient whose SimpleVirus particles all have the same maxBirthProb and
+    clearProb, so that only their number is kept. Each update() draws the
+    cleared and the newborn particles as two binomial counts, which have
+    exactly the distribution of the per-particle draws of Patient.update(),
+    at a cost that does not depend on the population size.
+    """
+
+    def __init__(self, numViruses, maxBirthProb, clearProb, maxPop,
+                 rng=numpy.random):
+        """
+        Initialization function, saves the parameters as attributes.
+
+        numViruses: the initial virus population (an integer)
+        maxBirthProb: Maximum reproduction probability (a float between 0-1)
+        clearProb: Maximum clearance probability (a float between 0-1)
+        maxPop: the maximum virus population for this patient (an integer)
+        rng: where the binomial counts are drawn from (numpy.random, a
+        numpy.random.RandomState or a ps_random.CounterStream)
+        """
+
+        self.numViruses = numViruses
+        self.maxBirthProb = float(maxBirthProb)
+        self.clearProb = float(clearProb)
+        self.maxPop = maxPop
+        self.rng = rng
+
+
+    def getTotalPop(self):
+        """
+        Gets the size of the current total virus population. 
+        returns: The total virus population (an integer)
+        """
+
+        return self.numViruses
+
+
+    def update(self):
+        """
+        Update the virus population for a single time step, in the same
+        order as Patient.update(): clearance, then the population density,
+        then reproduction of the survivors.
+
+        returns: The total virus population at the end of the update (an
+        integer)
+        """
+        #step 1
+        survivors = self.numViruses - \
+                    int(self.rng.binomial(self.numViruses, self.clearProb))
+
+        #step 2
+        popDensity = survivors/float(self.maxPop)
+
+        #step 3
+        # A population above maxPop does not reproduce at all
+        birthProb = max(self.maxBirthProb * (1 - popDensity), 0.0)
+        self.numViruses = survivors + int(self.rng.binomial(survivors,
+                                                            birthProb))
+        return self.numViruses
+
+
 #
 # PROBLEM 3
 #
 def simulationWithoutDrug(numViruses, maxPop, maxBirthProb, clearProb,
-                          numTrials):
+                          numTrials, checkpoint=None, checkpointInterval=60.0,
+                          streams=None, seed=None, aggregate=False):
     """
     Run the simulation and plot the graph for problem 3 (no drugs are used,
     viruses do not have any drug resistance).    
@@ -166,15 +663,61 @@ def simulationWithoutDrug(numViruses, maxPop, maxBirthProb, clearProb,
     maxBirthProb: Maximum reproduction probability (a float between 0-1)        
     clearProb: Maximum clearance probability (a float between 0-1)
     numTrials: number of simulation runs to execute (an integer)
+    checkpoint: path of a file to save the completed trials, the summed
+                populations and the random state to (see ps_checkpoint), or
+                None. If the file exists, the run resumes from it; it is
+                removed when the run is done.
+    checkpointInterval: minimum number of seconds between two saves of the
+                        checkpoint (a float)
+    streams: a factory of per-patient random streams (e.g.
+             ps_random.CounterStream), or None to draw from the random
+             module. The viruses of trial t then draw from
+             streams(seed, t), so each trial's numbers depend only on seed
+             and t.
+    seed: a non-negative int, or None to draw one from the random module
+          (only used with streams)
+    aggregate: if True, simulate each patient with an AggregatePatient,
+               which only counts the viruses; the populations have the
+               same distribution as with Patient, but draw their numbers
+               from numpy.random (or the streams) instead
     """
-    Patients = [Patient([SimpleVirus(maxBirthProb, clearProb) \
-                for v in range(numViruses)], maxPop) \
-                for t in range(numTrials)]
     num_timesteps = 300
     num_virus = [0 for n in range(num_timesteps)]
-    for patient in Patients:
+    trials_done = 0
+    saver = None
+    if checkpoint is not None:
+        saver = ps_checkpoint.Checkpoint(
+            checkpoint, repr(('simulationWithoutDrug', numViruses, maxPop,
+                              maxBirthProb, clearProb, numTrials,
+                              _streamsName(streams), seed, aggregate)),
+            checkpointInterval)
+        progress = saver.load()
+        if progress is not None:
+            trials_done = progress['trials']
+            num_virus = progress['num_virus']
+            seed = progress['seed']
+    if streams is not None and seed is None:
+        seed = random.getrandbits(32)
+    if aggregate:
+        Patients = [AggregatePatient(numViruses, maxBirthProb, clearProb,
+                                     maxPop, numpy.random if streams is None
+                                     else streams(seed, t))
+                    for t in range(numTrials)]
+    else:
+        rngs = [random if streams is None else streams(seed, t)
+                for t in range(numTrials)]
+        Patients = [Patient([SimpleVirus(maxBirthProb, clearProb, rngs[t]) \
+                    for v in range(numViruses)], maxPop) \
+                    for t in range(numTrials)]
+    for patient in Patients[trials_done:]:
         for timestep in range(num_timesteps):
             num_virus[timestep] += patient.update()
+        trials_done += 1
+        if saver is not None:
+            saver.save({'trials': trials_done, 'num_virus': num_virus,
+                        'seed': seed})
+    if saver is not None:
+        saver.finish()
     for timestep in range(num_timesteps):
         num_virus[timestep] /= float(numTrials)
     pylab.plot(num_virus, label='virus')
@@ -196,7 +739,8 @@ class ResistantVirus(SimpleVirus):
     Representation of a virus which can have drug resistance.
     """   
 
-    def __init__(self, maxBirthProb, clearProb, resistances, mutProb):
+    def __init__(self, maxBirthProb, clearProb, resistances, mutProb,
+                 rng=random):
         """
         Initialize a ResistantVirus instance, saves all parameters as attributes
         of the instance.
@@ -212,11 +756,26 @@ class ResistantVirus(SimpleVirus):
 
         mutProb: Mutation probability for this virus particle (a float). This is
         the probability of the offspring acquiring or losing resistance to a drug.
+
+        rng: where the particle and its offspring draw their random numbers
+        from (see SimpleVirus)
         """
 
-        SimpleVirus.__init__(self, maxBirthProb, clearProb)
-        self.resistances = resistances
+        SimpleVirus.__init__(self, maxBirthProb, clearProb, rng)
+        # Copied and read-only: a particle never changes its resistances,
+        # so its genotype (and the counts of its patient) stay right
+        self._resistances = _Resistances(resistances)
         self.mutProb = float(mutProb)
+        self.genotype = drugMask(drug for drug in resistances
+                                 if resistances[drug])
+
+
+    @property
+    def resistances(self):
+        """
+        The resistances of this particle (a read-only dict).
+        """
+        return self._resistances
 
 
     def isResistantTo(self, drug):
@@ -230,11 +789,9 @@ class ResistantVirus(SimpleVirus):
         returns: True if this virus instance is resistant to the drug, False
         otherwise.
         """
-        
-        try:
-            return self.resistances[drug]
-        except:
-            return False # assume no resistance if drug is not in resistances dictionary
+
+        # assume no resistance if drug is not in resistances dictionary
+        return self.resistances.get(drug, False)
 
 
     def reproduce(self, popDensity, activeDrugs):
@@ -285,16 +842,56 @@ class ResistantVirus(SimpleVirus):
         for drug in activeDrugs:
             if not self.isResistantTo(drug):
                 raise NoChildException
-        if random.random() < self.maxBirthProb * (1 - popDensity):
+        if self.rng.random() < self.maxBirthProb * (1 - popDensity):
             offspring_resistances = copy.deepcopy(self.resistances)
             for drug in self.resistances.keys():
-                if random.random() < self.mutProb: # mutation occurs (i.e., not resistant -> resistant, resistant -> not resistant)
+                if self.rng.random() < self.mutProb: # mutation occurs (i.e., not resistant -> resistant, resistant -> not resistant)
                     offspring_resistances[drug] = not self.resistances[drug]
-            return ResistantVirus(self.maxBirthProb, self.clearProb, offspring_resistances, self.mutProb)
+            return ResistantVirus(self.maxBirthProb, self.clearProb, offspring_resistances, self.mutProb, self.rng)
         else:
             raise NoChildException         
 
 
+    @classmethod
+    def reproduceMany(cls, viruses, popDensity, activeDrugs=None):
+        """
+        Calls reproduce() for each particle of VIRUSES (instances of this
+        class), in order, and returns the offspring: the same draws and the
+        same offspring, without a NoChildException for each particle that
+        does not reproduce. Particles not resistant to all of ACTIVEDRUGS
+        are skipped with one bitmask test.
+
+        viruses: the parent particles (a list)
+
+        popDensity: the population density (a float)
+
+        activeDrugs: the drugs acting on the particles (a list of strings,
+        or None for no drugs)
+
+        returns: the offspring (a list), in the order of their parents
+        """
+        if cls.reproduce.im_func is not ResistantVirus.reproduce.im_func:
+            return _reproduceEach(viruses, popDensity, activeDrugs)
+        mask = drugMask(activeDrugs or (), register=False)
+        if mask is None:
+            # Nothing resists a drug that was never registered
+            return []
+        offspring = []
+        for virus in viruses:
+            if virus.genotype & mask != mask:
+                continue
+            rng = virus.rng
+            if rng.random() < virus.maxBirthProb * (1 - popDensity):
+                resistances = virus.resistances.copy()
+                for drug in virus.resistances.keys():
+                    if rng.random() < virus.mutProb:
+                        resistances[drug] = not virus.resistances[drug]
+                offspring.append(ResistantVirus(virus.maxBirthProb,
+                                                virus.clearProb, resistances,
+                                                virus.mutProb, rng))
+        return offspring
+
+
             
 
 class TreatedPatient(Patient):
@@ -346,14 +943,12 @@ class TreatedPatient(Patient):
         returns: The population of viruses (an integer) with resistances to all
         drugs in the drugResist list.
         """
-        num = 0
-        for virus in self.viruses:
-            for drug in drugResist:
-                if not virus.isResistantTo(drug):
-                    break
-            else:
-                num += 1
-        return num
+        mask = drugMask(drugResist, register=False)
+        if mask is None:
+            return 0
+        return sum(number for genotype, number in
+                   self.population.getGenotypeCounts().iteritems()
+                   if genotype & mask == mask)
                 
 
 
@@ -378,27 +973,214 @@ class TreatedPatient(Patient):
         integer)
         """
 
+        if ps_kernels.useKernels():
+            rng = _sharedRNG(self.population, ResistantVirus)
+            if rng is not None:
+                return self._updateWithKernels(rng)
+
         #step 1
-        viruses_copy = self.viruses[:]
-        for virus in viruses_copy:
-            if virus.doesClear():
-                self.viruses.remove(virus)
+        self.population.keep([not virus.doesClear()
+                              for virus in self.population])
                 
         #step 2
         popDensity = self.getTotalPop() / float(self.maxPop)
         
         #step 3
-        viruses_copy2 = self.viruses[:]
-        for virus in viruses_copy2:
-            try:
-                offspring = virus.reproduce(popDensity, self.Rx)
-                self.viruses.append(offspring)
-            except NoChildException:
-                continue
+        offspring = []
+        for virus_type, viruses in itertools.groupby(self.population, type):
+            offspring.extend(virus_type.reproduceMany(list(viruses),
+                                                      popDensity, self.Rx))
+        self.population.extend(offspring)
                 
         return self.getTotalPop()
 
 
+    def _updateWithKernels(self, rng):
+        """
+        update() for a population of ResistantViruses sharing the random
+        stream RNG, with reproduction and mutation decided by
+        ps_kernels.reproduceResistant. Gives the same population, in the
+        same order, and leaves RNG in the same state as update().
+        """
+        population = self.population
+        population.keep(~_clearedMask(population, rng))
+        popDensity = len(population) / float(self.maxPop)
+        # Only particles resistant to every drug draw a birth number
+        mask = drugMask(self.Rx, register=False)
+        if mask is None:
+            parents = []
+        else:
+            parents = population.getParticles()[
+                population.getGenotypes() & mask == mask].tolist()
+        keys = [virus.resistances.keys() for virus in parents]
+        num_keys = numpy.array([len(k) for k in keys], dtype=numpy.intp)
+        offsets = numpy.zeros(len(parents), dtype=numpy.intp)
+        offsets[1:] = numpy.cumsum(num_keys)[:-1]
+        birth_probs = numpy.array([virus.maxBirthProb for virus in parents],
+                                  dtype=float)
+        mut_probs = numpy.array([virus.mutProb for virus in parents],
+                                dtype=float)
+        born = numpy.zeros(len(parents), dtype=bool)
+        flips = numpy.zeros(int(num_keys.sum()), dtype=bool)
+        # Draw no more numbers than are certainly needed: one per remaining
+        # parent, plus the traits of a parent known to reproduce
+        draws = numpy.zeros(0)
+        i, used, pending = 0, 0, False
+        while i < len(parents):
+            need = len(parents) - i + (num_keys[i] if pending else 0)
+            draws = numpy.concatenate((draws[used:], ps_kernels.uniforms(
+                need - (len(draws) - used), rng)))
+            i, used, pending = ps_kernels.reproduceResistant(
+                draws, i, birth_probs, popDensity, num_keys, offsets,
+                mut_probs, born, flips)
+        offspring = []
+        for p in numpy.flatnonzero(born).tolist():
+            virus = parents[p]
+            resistances = copy.deepcopy(virus.resistances)
+            for j, drug in enumerate(keys[p]):
+                if flips[offsets[p] + j]:
+                    resistances[drug] = not virus.resistances[drug]
+            offspring.append(ResistantVirus(virus.maxBirthProb,
+                                            virus.clearProb, resistances,
+                                            virus.mutProb, rng))
+        population.extend(offspring)
+        return self.getTotalPop()
+
+
+class GenotypePatient(object):
+    """
+    A treated patient whose ResistantVirus particles all have the same
+    maxBirthProb, clearProb and mutProb, so that only the number of
+    particles of each genotype (combination of resistances) is kept.
+
+    With d drugs there are 2 ** d genotypes; genotype g is resistant to
+    drugs[j] if bit j of g is set. Each update() draws clearance,
+    reproduction and mutation as binomial counts per genotype, with the
+    same distribution as the per-particle draws of TreatedPatient.update(),
+    at a cost of O(2 ** d * d) per step whatever the population size.
+    """
+
+    def __init__(self, numViruses, maxBirthProb, clearProb, resistances,
+                 mutProb, maxPop, rng=numpy.random):
+        """
+        Initialization function, saves the parameters as attributes. Also
+        initializes the list of drugs being administered (which should
+        initially include no drugs).
+
+        numViruses: the initial virus population, all with RESISTANCES (an
+        integer)
+        maxBirthProb: Maximum reproduction probability (a float between 0-1)
+        clearProb: Maximum clearance probability (a float between 0-1)
+        resistances: A dictionary of drug names (strings) mapping to the
+        initial resistance (True or False) to each drug
+        mutProb: Mutation probability (a float between 0-1)
+        maxPop: The maximum virus population for this patient (an integer)
+        rng: where the binomial counts are drawn from (numpy.random, a
+        numpy.random.RandomState or a ps_random.CounterStream)
+        """
+
+        self.drugs = sorted(resistances)
+        self.maxBirthProb = float(maxBirthProb)
+        self.clearProb = float(clearProb)
+        self.mutProb = float(mutProb)
+        self.maxPop = maxPop
+        self.rng = rng
+        self.Rx = []
+        self.counts = numpy.zeros(2 ** len(self.drugs), dtype=numpy.int64)
+        self.counts[self._mask(drug for drug in self.drugs
+                               if resistances[drug])] = numViruses
+        genotypes = numpy.arange(len(self.counts))
+        # The genotype each genotype turns into when drug j's bit flips
+        self.flipped = [genotypes ^ (1 << j) for j in range(len(self.drugs))]
+
+
+    def _mask(self, drugs):
+        """
+        Returns the genotype bits of DRUGS, or None if one of them is not
+        among the patient's drugs (no genotype resists it).
+        """
+        mask = 0
+        for drug in drugs:
+            if drug not in self.drugs:
+                return None
+            mask |= 1 << self.drugs.index(drug)
+        return mask
+
+
+    def _resisting(self, drugs):
+        """
+        Returns a boolean array telling which genotypes resist all of DRUGS.
+        """
+        mask = self._mask(drugs)
+        if mask is None:
+            return numpy.zeros(len(self.counts), dtype=bool)
+        return (numpy.arange(len(self.counts)) & mask) == mask
+
+
+    def addPrescription(self, newDrug):
+        """
+        Administer a drug to this patient (see TreatedPatient).
+
+        newDrug: The name of the drug to administer to the patient (a string).
+        """
+
+        if newDrug not in self.Rx:
+            self.Rx.append(newDrug)
+
+
+    def getTotalPop(self):
+        """
+        Gets the size of the current total virus population. 
+        returns: The total virus population (an integer)
+        """
+
+        return int(self.counts.sum())
+
+
+    def getResistPop(self, drugResist):
+        """
+        Get the population of virus particles resistant to the drugs listed
+        in drugResist (see TreatedPatient).
+
+        returns: The population of viruses (an integer) with resistances to
+        all drugs in the drugResist list.
+        """
+
+        return int(self.counts[self._resisting(drugResist)].sum())
+
+
+    def update(self):
+        """
+        Update the virus population for a single time step, in the same
+        order as TreatedPatient.update(): clearance, then the population
+        density, then reproduction of the survivors resistant to every
+        prescribed drug, each offspring switching each resistance with
+        probability mutProb.
+
+        returns: The total virus population at the end of the update (an
+        integer)
+        """
+        #step 1
+        survivors = self.counts - self.rng.binomial(self.counts,
+                                                    self.clearProb)
+
+        #step 2
+        popDensity = survivors.sum()/float(self.maxPop)
+
+        #step 3
+        birthProb = max(self.maxBirthProb * (1 - popDensity), 0.0)
+        parents = numpy.where(self._resisting(self.Rx), survivors, 0)
+        offspring = self.rng.binomial(parents, birthProb)
+        # Resistances mutate independently, so flipping one bit at a time
+        # gives the joint distribution of the offspring's genotypes
+        for flipped in self.flipped:
+            flips = self.rng.binomial(offspring, self.mutProb)
+            offspring = offspring - flips
+            offspring[flipped] += flips
+        self.counts = survivors + offspring
+        return self.getTotalPop()
+
+
 ##test 
 #virus1 = ResistantVirus(1.0, 0.0, {"drug1": True}, 0.0)
 #virus2 = ResistantVirus(1.0, 0.0, {"drug1": False, "drug2": True}, 0.0)
@@ -478,7 +1260,9 @@ def simulationWithDrug(numViruses, maxPop, maxBirthProb, clearProb, resistances,
 # Just for fun: adding more parameters to simulationWithDrug
 def simulationWithDrug_v2(numViruses, maxPop, maxBirthProb, clearProb, resistances,
                        mutProb, numTrials, stepBeforeDrug = 150, stepAfterDrug = 150,
-                       Rx = ['guttagonol']):
+                       Rx = ['guttagonol'], checkpoint = None,
+                       checkpointInterval = 60.0, streams = None, seed = None,
+                       genotypes = False):
     """
     Runs simulations and plots graphs for problem 5.
 
@@ -502,19 +1286,62 @@ def simulationWithDrug_v2(numViruses, maxPop, maxBirthProb, clearProb, resistanc
     stepAfterDrug: number of timesteps of simulation to run 
                     after drug administration (an integer)
     Rx: a list of drugs to be prescribed
+    checkpoint: path of a file to save the completed trials, the summed
+                populations and the random state to (see ps_checkpoint), or
+                None. If the file exists, the run resumes from it; it is
+                removed when the run is done.
+    checkpointInterval: minimum number of seconds between two saves of the
+                        checkpoint (a float)
+    streams: a factory of per-patient random streams (e.g.
+             ps_random.CounterStream), or None to draw from the random
+             module. The viruses of trial t then draw from
+             streams(seed, t), so each trial's numbers depend only on seed
+             and t.
+    seed: a non-negative int, or None to draw one from the random module
+          (only used with streams)
+    genotypes: if True, simulate each patient with a GenotypePatient,
+               which only counts the viruses of each genotype; the
+               populations have the same distribution as with
+               TreatedPatient, but draw their numbers from numpy.random (or
+               the streams) instead
     
     """
 
-    Patients = [TreatedPatient([ResistantVirus(maxBirthProb, clearProb, resistances, mutProb) \
-                for v in range(numViruses)], maxPop) \
-                for t in range(numTrials)]
     total_timesteps = stepBeforeDrug + stepAfterDrug
     virus_count = [0 for n in range(total_timesteps)]
     virus = {'total virus': virus_count[:]}
     for drug in Rx:
         virus[drug] = virus_count[:]
+    trials_done = 0
+    saver = None
+    if checkpoint is not None:
+        saver = ps_checkpoint.Checkpoint(
+            checkpoint, repr(('simulationWithDrug_v2', numViruses, maxPop,
+                              maxBirthProb, clearProb, sorted(resistances.items()),
+                              mutProb, numTrials, stepBeforeDrug, stepAfterDrug,
+                              Rx, _streamsName(streams), seed, genotypes)),
+            checkpointInterval)
+        progress = saver.load()
+        if progress is not None:
+            trials_done = progress['trials']
+            virus = progress['virus']
+            seed = progress['seed']
+    if streams is not None and seed is None:
+        seed = random.getrandbits(32)
+    if genotypes:
+        Patients = [GenotypePatient(numViruses, maxBirthProb, clearProb,
+                                    resistances, mutProb, maxPop,
+                                    numpy.random if streams is None
+                                    else streams(seed, t))
+                    for t in range(numTrials)]
+    else:
+        rngs = [random if streams is None else streams(seed, t)
+                for t in range(numTrials)]
+        Patients = [TreatedPatient([ResistantVirus(maxBirthProb, clearProb, resistances, mutProb, rngs[t]) \
+                    for v in range(numViruses)], maxPop) \
+                    for t in range(numTrials)]
     
-    for patient in Patients:
+    for patient in Patients[trials_done:]:
         #before drug administration
         for timestep in range(stepBeforeDrug):
             virus['total virus'][timestep] += patient.update()
@@ -528,6 +1355,11 @@ def simulationWithDrug_v2(numViruses, maxPop, maxBirthProb, clearProb, resistanc
             virus['total virus'][stepBeforeDrug + timestep] += patient.update()
             for drug in Rx:
                 virus[drug][stepBeforeDrug + timestep] += patient.getResistPop(Rx)
+        trials_done += 1
+        if saver is not None:
+            saver.save({'trials': trials_done, 'virus': virus, 'seed': seed})
+    if saver is not None:
+        saver.finish()
         
     for timestep in range(total_timesteps):
         for value in virus.values():
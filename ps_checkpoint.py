@@ -0,0 +1,91 @@
+# Problem Sets 2 and 3:
+# Checkpoints for long simulation runs.
+#
+# ps2.runSimulation, ps3b.simulationWithoutDrug and ps3b.simulationWithDrug_v2
+# take a checkpoint path. While they run, the completed trials, the sums
+# accumulated so far and the state of the random number generators are
+# written to that file every so often; if the run is interrupted, calling the
+# function again with the same arguments resumes from the file and gives the
+# numbers the uninterrupted run would have given.
+
+import cPickle
+import os
+import random
+import time
+
+import numpy
+
+
+class CheckpointMismatchException(Exception):
+    """
+    Raised when a checkpoint file was written by a run with different
+    arguments.
+    """
+
+
+class Checkpoint(object):
+    """
+    A Checkpoint saves the progress of one run to a file, at most once every
+    INTERVAL seconds.
+    """
+    def __init__(self, path, key, interval=60.0):
+        """
+        path: the checkpoint file (a string)
+        key: a string identifying the run (its arguments); a file with a
+             different key is not resumed from
+        interval: minimum number of seconds between two saves (a float)
+        """
+        self.path = path
+        self.key = key
+        self.interval = interval
+        self.last_save = time.time()
+
+    def load(self):
+        """
+        Returns the progress saved in the checkpoint file (a dict), and
+        restores the random module and NumPy's global generator to their
+        states at that point. Returns None if there is no file.
+
+        Raises a CheckpointMismatchException if the file belongs to another
+        run.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            saved = cPickle.load(f)
+        if saved['key'] != self.key:
+            raise CheckpointMismatchException(
+                "%s was written by a different run: %s" %
+                (self.path, saved['key']))
+        random.setstate(saved['random'])
+        numpy.random.set_state(saved['numpy'])
+        return saved['progress']
+
+    def save(self, progress, force=False):
+        """
+        Writes PROGRESS (a picklable dict) and the current random states to
+        the checkpoint file, if INTERVAL seconds have passed since the last
+        save or FORCE is True.
+
+        The file is written under a temporary name and then renamed, so an
+        interruption never leaves a truncated checkpoint behind.
+        """
+        if not force and time.time() - self.last_save < self.interval:
+            return
+        saved = {'key': self.key, 'progress': progress,
+                 'random': random.getstate(),
+                 'numpy': numpy.random.get_state()}
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            cPickle.dump(saved, f, cPickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp, self.path)
+        self.last_save = time.time()
+
+    def finish(self):
+        """
+        Removes the checkpoint file of a completed run.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
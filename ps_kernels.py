@@ -0,0 +1,268 @@
+# Problem Sets 2 and 3:
+# Optional compiled kernels for the robot and virus simulations.
+#
+# The kernels below work on NumPy arrays and plain numbers only. When numba
+# is installed it is imported and they are compiled on first use (not on
+# import, so processes that never call a kernel do not pay for numba), and
+# ps2.runTrial,
+# ps3b.Patient.update and ps3b.TreatedPatient.update call them; otherwise the
+# simulations keep their pure-Python code. Random numbers still come from the
+# random module (or from a ps_random stream), drawn in blocks and handed to
+# the kernels, and the kernels consume them in the same order as the Python
+# code, so a seeded run gives the same results with either backend and
+# leaves the random module in the same state.
+
+import functools
+import imp
+import random
+
+import numpy
+
+
+def _findNumba():
+    "Returns True if numba can be imported, without importing it."
+    try:
+        imp.find_module('numba')
+    except ImportError:
+        return False
+    return True
+
+
+NUMBA = _findNumba()
+
+BACKENDS = ('python', 'kernels')
+
+# 'kernels' runs the kernels below (compiled if numba is installed, as plain
+# Python otherwise, which is only useful to check them); 'python' runs the
+# simulations' own code
+backend = 'kernels' if NUMBA else 'python'
+
+
+def jit(func):
+    """
+    Returns FUNC unchanged if numba is not installed, and otherwise a wrapper
+    that imports numba and compiles FUNC on its first call.
+    """
+    if not NUMBA:
+        return func
+    compiled = []
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        if not compiled:
+            import numba
+            compiled.append(numba.njit(cache=True)(func))
+        return compiled[0](*args)
+    return wrapper
+
+
+def setBackend(name):
+    """
+    Selects the backend used by the simulations and returns the previous one.
+
+    name: 'python' or 'kernels'
+    """
+    global backend
+    if name not in BACKENDS:
+        raise ValueError("unknown backend %r" % (name,))
+    previous, backend = backend, name
+    return previous
+
+
+def useKernels():
+    """
+    Returns True if the simulations should call the kernels.
+    """
+    return backend == 'kernels'
+
+
+def uniforms(n, rng=random):
+    """
+    Returns the next N numbers of RNG.random() as a float array.
+    """
+    if hasattr(rng, 'randoms'):
+        # A ps_random.CounterStream hands out its numbers in bulk
+        return rng.randoms(n)
+    rand = rng.random
+    return numpy.array([rand() for i in xrange(n)], dtype=float)
+
+
+class UniformBlocks(object):
+    """
+    Hands out blocks of RNG.random() numbers to a kernel that uses an unknown
+    number of them, and afterwards leaves RNG exactly as if only the used
+    numbers had been drawn.
+    """
+    def __init__(self, size=4096, rng=random):
+        """
+        size: numbers per block (an int > 0)
+        rng: the random number generator (the random module or a
+             random.Random)
+        """
+        self.size = size
+        self.rng = rng
+        self.state = None
+
+    def next(self):
+        """
+        Returns the next block of numbers.
+        """
+        self.state = self.rng.getstate()
+        return uniforms(self.size, self.rng)
+
+    def settle(self, used):
+        """
+        Rewinds RNG to the start of the last block and draws the USED numbers
+        of it that the kernel consumed.
+        """
+        if self.state is not None:
+            self.rng.setstate(self.state)
+            rand = self.rng.random
+            for i in xrange(used):
+                rand()
+            self.state = None
+
+
+@jit
+def robotSteps(x, y, direction, speed, walker, tiles, width, height,
+               num_cleaned, num_tiles, min_coverage, cleaned_log, step, robot,
+               draws, sin_table, cos_table):
+    """
+    Advances a fleet of robots one time-step at a time, robot by robot, until
+    the fraction MIN_COVERAGE of the room is clean or DRAWS runs out.
+
+    Robot i is at (x[i], y[i]) with direction direction[i] (whole degrees)
+    and speed speed[i]. It moves if the move stays in the WIDTH x HEIGHT
+    room, cleaning tile (m, n) at tiles[m * height + n] and appending that
+    index to CLEANED_LOG if the tile was dirty. A robot that cannot move,
+    and a walker[i] robot in any case, takes the next number u of DRAWS and
+    turns to int(u * 360). The run starts at robot ROBOT of time-step STEP.
+
+    Returns (step, robot, num_cleaned, used, done): where to resume, the
+    number of clean tiles, the number of DRAWS used, and whether the
+    coverage was reached.
+    """
+    used = 0
+    num_robots = len(x)
+    while True:
+        if robot == 0 and not num_cleaned / num_tiles < min_coverage:
+            return step, robot, num_cleaned, used, True
+        for i in range(robot, num_robots):
+            d = direction[i]
+            new_x = x[i] + speed[i] * sin_table[d]
+            new_y = y[i] + speed[i] * cos_table[d]
+            inside = 0 <= new_x < width and 0 <= new_y < height
+            turns = walker[i] or not inside
+            if turns and used == len(draws):
+                return step, i, num_cleaned, used, False
+            if inside:
+                x[i] = new_x
+                y[i] = new_y
+                index = int(new_x) * height + int(new_y)
+                if tiles[index] == 0:
+                    tiles[index] = 1
+                    cleaned_log[num_cleaned] = index
+                    num_cleaned += 1
+            if turns:
+                direction[i] = int(draws[used] * 360)
+                used += 1
+        robot = 0
+        step += 1
+
+
+@jit
+def reproduceResistant(draws, start, birth_probs, pop_density, num_keys,
+                       offsets, mut_probs, born, flips):
+    """
+    Decides, in order from particle START, which resistant virus particles
+    reproduce, and which resistance traits their offspring switch.
+
+    Particle i reproduces if the next number of DRAWS is below
+    birth_probs[i] * (1 - POP_DENSITY); its offspring then takes one number
+    per trait j < num_keys[i], switching the trait (flips[offsets[i] + j])
+    if it is below mut_probs[i]. Particles are only processed while DRAWS
+    has all the numbers they need.
+
+    Returns (next particle, used, pending): where to resume, the number of
+    DRAWS used, and whether the next particle reproduces but its traits did
+    not fit in DRAWS (its birth number is then left unused).
+    """
+    used = 0
+    i = start
+    while i < len(birth_probs):
+        if used == len(draws):
+            return i, used, False
+        if draws[used] < birth_probs[i] * (1 - pop_density):
+            if len(draws) - used - 1 < num_keys[i]:
+                return i, used, True
+            born[i] = True
+            used += 1
+            for j in range(num_keys[i]):
+                flips[offsets[i] + j] = draws[used] < mut_probs[i]
+                used += 1
+        else:
+            used += 1
+        i += 1
+    return i, used, False
+
+
+def compareBackends(seed=0):
+    """
+    Runs seeded robot trials and virus simulations with both backends and
+    returns a list of (name, python result, kernels result) for every
+    mismatch; an empty list means the backends agree.
+    """
+    import ps2
+    import ps3b
+
+    def robots(fleet):
+        # FLEET is a robot type or a fleet spec (see ps2.fleetSpec)
+        if isinstance(fleet, list):
+            num_robots, robot_type = fleet, None
+        else:
+            num_robots, robot_type = 4, fleet
+        return [ps2.runTrial(num_robots, 1.0, 12, 9, 0.9, robot_type,
+                             room_type, seed=seed + t)
+                for room_type in (ps2.RectangularRoom, ps2.BitmapRoom)
+                for t in range(5)]
+
+    def patient():
+        random.seed(seed)
+        viruses = [ps3b.SimpleVirus(0.1, 0.05) for v in range(100)]
+        patient = ps3b.Patient(viruses, 1000)
+        return [patient.update() for t in range(200)]
+
+    def treated():
+        random.seed(seed)
+        viruses = [ps3b.ResistantVirus(0.1, 0.05, {'drug1': False,
+                                                   'drug2': True}, 0.05)
+                   for v in range(100)]
+        patient = ps3b.TreatedPatient(viruses, 1000)
+        result = []
+        for t in range(300):
+            if t == 150:
+                patient.addPrescription('drug1')
+            result.append((patient.update(), patient.getResistPop(['drug1'])))
+        return result
+
+    # A mixed fleet whose StandardRobots are not adjacent
+    mixed = [(ps2.StandardRobot, 1.0, 1), (ps2.RandomWalkRobot, 1.0, 1),
+             (ps2.StandardRobot, 1.0, 1)]
+
+    checks = [('StandardRobot', lambda: robots(ps2.StandardRobot)),
+              ('RandomWalkRobot', lambda: robots(ps2.RandomWalkRobot)),
+              ('mixed fleet', lambda: robots(mixed)),
+              ('Patient', patient), ('TreatedPatient', treated)]
+    mismatches = []
+    previous = backend
+    try:
+        for name, check in checks:
+            results = []
+            for name_of_backend in BACKENDS:
+                setBackend(name_of_backend)
+                results.append((check(), random.random()))
+            if results[0] != results[1]:
+                mismatches.append((name, results[0], results[1]))
+    finally:
+        setBackend(previous)
+    return mismatches
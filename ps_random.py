@@ -0,0 +1,91 @@
+# Problem Sets 2 and 3:
+# Per-entity random streams for reproducible simulations.
+#
+# By default the simulations draw from the random module, so a seeded result
+# depends on the order in which trials, robots and patients consume it. A
+# CounterStream instead gives each entity (a robot of a trial, a patient) its
+# own stream, keyed by (seed, entity): the numbers an entity sees do not
+# depend on anything else that runs, so serial, pooled and vectorized runs
+# give the same results.
+
+import numpy
+
+
+# NumPy 1.17 and later have the counter-based Philox generator; older
+# versions fall back to a Mersenne Twister seeded with the whole key
+_PHILOX = getattr(numpy.random, 'Philox', None)
+
+_MASK32 = 0xffffffff
+
+
+def _words(value, count):
+    """
+    Returns the COUNT low 32-bit words of the non-negative int VALUE.
+    """
+    return [(value >> (32 * i)) & _MASK32 for i in range(count)]
+
+
+class CounterStream(object):
+    """
+    A CounterStream is the random stream of one entity, keyed by (SEED,
+    ENTITY). It has the random() method of the random module, and fills a
+    buffer of BLOCK numbers at a time instead of making one generator call
+    per number.
+    """
+    __slots__ = ('generator', 'buffer', 'index', 'block')
+
+    def __init__(self, seed, entity, block=256):
+        """
+        seed: a non-negative int (e.g. ps2.trialSeed(seed, trial)), less
+              than 2 ** 128
+        entity: a non-negative int numbering the entity (e.g. a robot of
+                the trial), less than 2 ** 64
+        block: numbers per buffer refill (an int > 0)
+        """
+        if _PHILOX is not None:
+            # The entity selects a disjoint range of the counter
+            self.generator = numpy.random.Generator(
+                _PHILOX(key=seed, counter=[0, 0, 0, entity]))
+        else:
+            self.generator = numpy.random.RandomState(
+                _words(entity, 2) + _words(seed, 4))
+        self.buffer = []
+        self.index = 0
+        self.block = block
+
+    def _draw(self, n):
+        "Returns the next N numbers of the generator (a float array)."
+        if _PHILOX is not None:
+            return self.generator.random(n)
+        return self.generator.random_sample(n)
+
+    def random(self):
+        """
+        Returns the next random float in [0.0, 1.0).
+        """
+        if self.index == len(self.buffer):
+            self.buffer = self._draw(self.block).tolist()
+            self.index = 0
+        value = self.buffer[self.index]
+        self.index += 1
+        return value
+
+    def binomial(self, n, p):
+        """
+        Returns the number of successes of N trials with success probability
+        P, drawn from the stream's generator. Like
+        numpy.random.binomial, N may be an int array, giving an array.
+        """
+        return self.generator.binomial(n, p)
+
+    def randoms(self, n):
+        """
+        Returns the next N random floats as an array: the same numbers as N
+        calls of random().
+        """
+        buffered = self.buffer[self.index:self.index + n]
+        self.index += len(buffered)
+        if len(buffered) == n:
+            return numpy.array(buffered, dtype=float)
+        return numpy.concatenate((numpy.array(buffered, dtype=float),
+                                  self._draw(n - len(buffered))))
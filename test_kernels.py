@@ -0,0 +1,82 @@
+# Problem Sets 2 and 3:
+# Checks that the kernels backend gives the same results as the pure-Python
+# code of the simulations.
+#
+# Usage: python -m unittest test_kernels
+
+import random
+import sys
+import unittest
+
+import ps3b
+import ps_kernels
+import ps_random
+
+
+def _bothBackends(check, seed):
+    """
+    Runs CHECK once with each backend, with the random module seeded with
+    SEED, and returns the (result, next number of the random module) pairs,
+    in the order of ps_kernels.BACKENDS.
+    """
+    results = []
+    previous = ps_kernels.backend
+    try:
+        for name in ps_kernels.BACKENDS:
+            ps_kernels.setBackend(name)
+            random.seed(seed)
+            results.append((check(), random.random()))
+    finally:
+        ps_kernels.setBackend(previous)
+    return results
+
+
+def _streamPatient(seed):
+    "Steps a Patient whose particles draw from a CounterStream."
+    rng = ps_random.CounterStream(seed, 0)
+    viruses = [ps3b.SimpleVirus(0.1, 0.05, rng) for v in range(100)]
+    patient = ps3b.Patient(viruses, 1000)
+    return [patient.update() for t in range(200)]
+
+
+def _streamTreatedPatient(seed):
+    "Steps a TreatedPatient whose particles draw from a CounterStream."
+    rng = ps_random.CounterStream(seed, 0)
+    viruses = [ps3b.ResistantVirus(0.1, 0.05, {'drug1': False,
+                                               'drug2': True}, 0.05, rng)
+               for v in range(100)]
+    patient = ps3b.TreatedPatient(viruses, 1000)
+    result = []
+    for t in range(300):
+        if t == 150:
+            patient.addPrescription('drug1')
+        result.append((patient.update(), patient.getResistPop(['drug1'])))
+    return result
+
+
+class BackendsTest(unittest.TestCase):
+
+    def testCompareBackends(self):
+        for seed in range(3):
+            self.assertEqual(ps_kernels.compareBackends(seed), [])
+
+    def testStreamPatient(self):
+        for seed in range(3):
+            python, kernels = _bothBackends(lambda: _streamPatient(seed), seed)
+            self.assertEqual(python, kernels)
+
+    def testStreamTreatedPatient(self):
+        for seed in range(3):
+            python, kernels = _bothBackends(
+                lambda: _streamTreatedPatient(seed), seed)
+            self.assertEqual(python, kernels)
+
+    @unittest.skipUnless(ps_kernels.NUMBA, "numba is not installed")
+    def testCompiled(self):
+        # With numba installed the kernels backend runs compiled code
+        self.assertEqual(ps_kernels.compareBackends(), [])
+        self.assertIn('numba', sys.modules)
+
+
+if __name__ == '__main__':
+    unittest.main()